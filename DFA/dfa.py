@@ -1,3 +1,8 @@
+from array import array
+from bisect import bisect_right
+from itertools import count
+
+
 class FARule:
     def __init__(self, state, character, next_state):
         self.state = state
@@ -15,17 +20,148 @@ class FARule:
     
 
 class DFARulebook:
+    DEAD_STATE = float('-inf')
     def __init__(self, rules):
         self.rules = rules
     
     def next_state(self, state, character):
-        return self.rule_for(state, character).follow()
+        rule = self.rule_for(state, character)
+        if rule is None:
+            return DFARulebook.DEAD_STATE
+        return rule.follow()
+
+    def next_state_for_string(self, state, string):
+        for char in string:
+            state = self.next_state(state, char)
+        return state
     
     def rule_for(self, state, character):
         for rule in self.rules:
             if rule.is_applies_to(state, character):
                 return rule
 
+    def compile(self):
+        return CompiledDFARulebook(self.rules)
+
+
+class CompiledDFARulebook:
+    """Dense next-state table indexed by integer state ids and character class ids"""
+    def __init__(self, rules):
+        self.rules = rules
+        self.states = []
+        self.state_ids = {}
+        for rule in rules:
+            self.state_id(rule.state)
+            self.state_id(rule.next_state)
+        transitions = {}
+        # go in reverse so the first matching rule wins, as in DFARulebook.rule_for
+        for rule in reversed(rules):
+            transitions.setdefault(rule.character, {})[self.state_ids[rule.state]] = self.state_ids[rule.next_state]
+        # the dead state swallows missing transitions and never leaves
+        self.dead_state_id = self.state_id(DFARulebook.DEAD_STATE)
+        signatures = {rule.character: frozenset(transitions[rule.character].items()) for rule in rules}
+        self.character_classes, class_count = alphabet_classes(signatures)
+        # the last column is shared by every character outside the alphabet
+        self.width = class_count + 1
+        self.unknown_class = self.width - 1
+        self.table = array('l', [self.dead_state_id]) * (len(self.states) * self.width)
+        for character, moves in transitions.items():
+            character_class = self.character_classes[character]
+            for state_id, next_state_id in moves.items():
+                self.table[state_id * self.width + character_class] = next_state_id
+
+    def state_id(self, state):
+        if state not in self.state_ids:
+            self.state_ids[state] = len(self.states)
+            self.states.append(state)
+        return self.state_ids[state]
+
+    def next_state(self, state, character):
+        state_id = self.state_ids.get(state, self.dead_state_id)
+        character_class = self.character_classes.get(character, self.unknown_class)
+        return self.states[self.table[state_id * self.width + character_class]]
+
+    def next_state_for_string(self, state, string):
+        if not string:
+            # a state that appears in no rule has no id, but it survives an empty string
+            return state
+        state_id = self.state_ids.get(state, self.dead_state_id)
+        return self.states[self.next_state_id_for_string(state_id, string)]
+
+    def next_state_id_for_string(self, state_id, string):
+        table, width, unknown_class = self.table, self.width, self.unknown_class
+        character_classes = self.character_classes
+        for char in string:
+            state_id = table[state_id * width + character_classes.get(char, unknown_class)]
+        return state_id
+
+    def class_ranges(self):
+        return class_ranges(self.character_classes, self.unknown_class)
+
+    def compile(self):
+        return self
+
+
+def alphabet_classes(signatures):
+    """Numbers characters so that characters behaving identically in every state share a class id"""
+    class_ids = {}
+    character_classes = {}
+    for character, signature in signatures.items():
+        character_classes[character] = class_ids.setdefault(signature, len(class_ids))
+    return character_classes, len(class_ids)
+
+
+def class_ranges(character_classes, unknown_class):
+    """Sorted (first code point, class id) ranges covering all of Unicode, for bisect lookup"""
+    starts, classes = [0], [unknown_class]
+    previous = -1
+    for point, character_class in sorted((ord(character), character_class)
+                                         for character, character_class in character_classes.items()
+                                         if isinstance(character, str) and len(character) == 1):
+        if point != previous + 1 and classes[-1] != unknown_class:
+            starts.append(previous + 1)
+            classes.append(unknown_class)
+        if starts[-1] == point:
+            classes[-1] = character_class
+        elif character_class != classes[-1]:
+            starts.append(point)
+            classes.append(character_class)
+        previous = point
+    if classes[-1] != unknown_class:
+        starts.append(previous + 1)
+        classes.append(unknown_class)
+    return starts, classes
+
+
+def class_for_code_point(ranges, point):
+    starts, classes = ranges
+    return classes[bisect_right(starts, point) - 1]
+
+
+def match_spans(start_states, next_states, is_accept, string):
+    """Unanchored search in one pass over any iterable of characters. Every state carries the
+    leftmost position it was started from, a new run is started at each position, and every
+    position where a match ends is reported as (leftmost start, end)"""
+    runs = {}
+    chars = iter(string)
+    end_of_string = object()
+    for position in count():
+        for state in start_states:
+            # a run already in this state started earlier, so it wins
+            runs.setdefault(state, position)
+        starts = [start for state, start in runs.items() if is_accept(state)]
+        if starts:
+            yield min(starts), position
+        char = next(chars, end_of_string)
+        if char is end_of_string:
+            return
+        next_runs = {}
+        for state, start in runs.items():
+            for next_state in next_states(state, char):
+                if next_state not in next_runs or start < next_runs[next_state]:
+                    next_runs[next_state] = start
+        runs = next_runs
+
 
 class DFA:
     def __init__(self, current_state, accept_states, rulebook):
@@ -37,16 +173,18 @@ class DFA:
         return self.current_state in self.accept_states
 
     def read_character(self, character):
-        self.current_state = rulebook.next_state(self.current_state, character)
+        self.current_state = self.rulebook.next_state(self.current_state, character)
         return self.current_state
     
     def read_string(self, string):
-        for char in string:
-            self.read_character(char)
+        self.current_state = self.rulebook.next_state_for_string(self.current_state, string)
         return self.current_state
 
 
 class DFADesign:
+    # characters mapped to class ids at a time in is_accepts_many
+    CLASS_BLOCK = 1 << 20
+
     def __init__(self, start_state, accept_states, rulebook):
         self.start_state = start_state
         self.accept_states = accept_states
@@ -60,8 +198,153 @@ class DFADesign:
         dfa.read_string(string)
         return dfa.is_accepting()
 
+    def compiled(self):
+        return DFADesign(self.start_state, self.accept_states, self.rulebook.compile())
+
+    def find_all(self, string):
+        rulebook = self.rulebook
+
+        def next_states(state, char):
+            next_state = rulebook.next_state(state, char)
+            return [] if next_state == DFARulebook.DEAD_STATE else [next_state]
+
+        return match_spans([self.start_state], next_states, lambda state: state in self.accept_states, string)
+
+    def search(self, string):
+        return next(self.find_all(string), None)
+
+    def is_accepts_many(self, strings):
+        import numpy as np
+
+        rulebook = self.rulebook.compile()
+        strings = list(strings)
+        state_count = len(rulebook.states)
+        table = np.asarray(rulebook.table, dtype=np.intp).reshape(state_count, rulebook.width)
+
+        lengths = np.fromiter((len(string) for string in strings), dtype=np.intp, count=len(strings))
+        offsets = np.cumsum(lengths) - lengths
+        # decode the whole batch at once into code points, then map code points to character classes
+        # a block at a time, keeping one small class id per character
+        points = np.frombuffer(''.join(strings).encode('utf-32-le'), dtype=np.uint32)
+        starts, classes = rulebook.class_ranges()
+        starts = np.array(starts, dtype=np.uint32)
+        class_dtype = np.uint8 if rulebook.width <= 1 << 8 else np.uint16 if rulebook.width <= 1 << 16 else np.uint32
+        classes = np.array(classes, dtype=class_dtype)
+        codes = np.empty(len(points), dtype=class_dtype)
+        for block in range(0, len(points), self.CLASS_BLOCK):
+            found = np.searchsorted(starts, points[block:block + self.CLASS_BLOCK], side='right') - 1
+            codes[block:block + self.CLASS_BLOCK] = classes[found]
+
+        accept = np.zeros(state_count, dtype=bool)
+        for state in self.accept_states:
+            if state in rulebook.state_ids:
+                accept[rulebook.state_ids[state]] = True
+
+        # longest strings first, so the strings still running at a column are a prefix that shrinks
+        order = np.argsort(-lengths, kind='stable')
+        negated_lengths, sorted_offsets = -lengths[order], offsets[order]
+        states = np.full(len(strings), rulebook.state_ids.get(self.start_state, rulebook.dead_state_id), dtype=np.intp)
+        max_length = int(lengths.max(initial=0))
+        for column in range(max_length):
+            active = int(np.searchsorted(negated_lengths, -column, side='left'))
+            states[:active] = table[states[:active], codes[sorted_offsets[:active] + column]]
+        accepted = np.empty(len(strings), dtype=bool)
+        accepted[order] = accept[states]
+        # the start state may not appear in any rule
+        accepted[lengths == 0] = self.start_state in self.accept_states
+        return accepted
+
+    def reachable_transitions(self):
+        """Reachable states in breadth-first order and their transitions, first matching rule wins"""
+        characters = []
+        for rule in self.rulebook.rules:
+            if rule.character not in characters:
+                characters.append(rule.character)
+        transitions = {}
+        for rule in reversed(self.rulebook.rules):
+            transitions[(rule.state, rule.character)] = rule.next_state
+        states = [self.start_state]
+        seen = {self.start_state}
+        for state in states:
+            for char in characters:
+                next_state = transitions.get((state, char), DFARulebook.DEAD_STATE)
+                if next_state not in seen:
+                    seen.add(next_state)
+                    states.append(next_state)
+        return states, characters, transitions
+
+    def state_count(self):
+        states, _, _ = self.reachable_transitions()
+        return len([state for state in states if state != DFARulebook.DEAD_STATE])
+
+    def minimize(self):
+        """Hopcroft partition refinement, returns the minimal design and the old to new state mapping;
+        states equivalent to the dead sink map to DFARulebook.DEAD_STATE"""
+        states, characters, transitions = self.reachable_transitions()
+        if DFARulebook.DEAD_STATE not in states:
+            states.append(DFARulebook.DEAD_STATE)
+        predecessors = {}
+        for state in states:
+            for char in characters:
+                next_state = transitions.get((state, char), DFARulebook.DEAD_STATE)
+                predecessors.setdefault((next_state, char), []).append(state)
+
+        accepting = set(state for state in states if state in self.accept_states)
+        blocks = [block for block in (set(accepting), set(states) - accepting) if block]
+        block_of = {}
+        for block_id, block in enumerate(blocks):
+            for state in block:
+                block_of[state] = block_id
+        # only the smaller half of every split needs to be used as a splitter again
+        worklist = [min(range(len(blocks)), key=lambda block_id: len(blocks[block_id]))]
+        waiting = set(worklist)
+        while worklist:
+            splitter = worklist.pop()
+            waiting.discard(splitter)
+            targets = list(blocks[splitter])
+            for char in characters:
+                touched = {}
+                for target in targets:
+                    for state in predecessors.get((target, char), []):
+                        touched.setdefault(block_of[state], set()).add(state)
+                for block_id, inside in touched.items():
+                    if len(inside) == len(blocks[block_id]):
+                        continue
+                    blocks[block_id] -= inside
+                    new_block_id = len(blocks)
+                    blocks.append(inside)
+                    for state in inside:
+                        block_of[state] = new_block_id
+                    if block_id in waiting or len(inside) <= len(blocks[block_id]):
+                        worklist.append(new_block_id)
+                        waiting.add(new_block_id)
+                    else:
+                        worklist.append(block_id)
+                        waiting.add(block_id)
+
+        # every block is named after its first state in breadth-first order, so the start state keeps its name
+        names = {}
+        for state in states:
+            names.setdefault(block_of[state], state)
+        dead_block_id = block_of[DFARulebook.DEAD_STATE]
+        names[dead_block_id] = DFARulebook.DEAD_STATE
+        state_mapping = {state: names[block_of[state]] for state in states if state != DFARulebook.DEAD_STATE}
+
+        rules = []
+        for state in states:
+            if names[block_of[state]] != state or block_of[state] == dead_block_id:
+                continue
+            for char in characters:
+                next_block_id = block_of[transitions.get((state, char), DFARulebook.DEAD_STATE)]
+                if next_block_id != dead_block_id:
+                    rules.append(FARule(state, char, names[next_block_id]))
+        accept_states = [state for state in states if state in accepting and names[block_of[state]] == state]
+        design = DFADesign(names[block_of[self.start_state]], accept_states, DFARulebook(rules))
+        return design, state_mapping
+
 
 if __name__ == "__main__":
+    from random import Random
 
     # DFA that only is_accepts character stream contains sequence 'ab'
     rulebook = DFARulebook([
@@ -97,3 +380,80 @@ if __name__ == "__main__":
     dfa_desgin = DFADesign(1, [3], rulebook)
     print(dfa_desgin.is_accepts('aaabbbbaaa')) # True
     print(dfa_desgin.is_accepts('bbbbbbbbaa')) # False
+
+    print('-' * 20)
+    compiled_rulebook = rulebook.compile()
+    assert compiled_rulebook.next_state(1, 'a') == 2
+    assert compiled_rulebook.next_state(2, 'b') == 3
+    assert compiled_rulebook.next_state(1, 'c') == DFARulebook.DEAD_STATE
+    assert rulebook.next_state(1, 'c') == DFARulebook.DEAD_STATE
+    compiled_design = dfa_desgin.compiled()
+    assert compiled_design.is_accepts('aaabbbbaaa')
+    assert not compiled_design.is_accepts('bbbbbbbbaa')
+    assert not compiled_design.is_accepts('abxab')
+    assert not dfa_desgin.is_accepts('abxab')
+    # a start state without rules survives the empty string, as in DFARulebook
+    assert compiled_rulebook.next_state_for_string(0, '') == rulebook.next_state_for_string(0, '') == 0
+    assert compiled_rulebook.next_state_for_string(0, 'a') == DFARulebook.DEAD_STATE
+
+    print('-' * 20)
+    strings = ['aaabbbbaaa', 'bbbbbbbbaa', 'abxab', '', 'ab', 'b']
+    assert list(dfa_desgin.is_accepts_many(strings)) == [dfa_desgin.is_accepts(s) for s in strings]
+    # one long string among short ones, and class ids mapped over several blocks
+    random = Random(0)
+    strings = ['ba' * 5000 + 'b', 'a' * 3000] + [''.join(random.choice('abc') for _ in range(random.randrange(8)))
+                                                 for _ in range(500)]
+    blocked_design = DFADesign(1, [3], rulebook)
+    blocked_design.CLASS_BLOCK = 1000
+    assert list(blocked_design.is_accepts_many(strings)) == [dfa_desgin.is_accepts(s) for s in strings]
+
+    print('-' * 20)
+    # states 3 and 4 both mean 'ab' has been seen, 5 is unreachable
+    redundant_design = DFADesign(1, [3, 4], DFARulebook([
+        FARule(1, 'a', 2), FARule(1, 'b', 1),
+        FARule(2, 'a', 2), FARule(2, 'b', 3),
+        FARule(3, 'a', 4), FARule(3, 'b', 3),
+        FARule(4, 'a', 4), FARule(4, 'b', 3),
+        FARule(5, 'a', 1), FARule(5, 'b', 5),
+    ]))
+    minimal_design, state_mapping = redundant_design.minimize()
+    print(redundant_design.state_count(), '->', minimal_design.state_count())  # 4 -> 3
+    assert redundant_design.state_count() == 4
+    assert minimal_design.state_count() == 3
+    assert state_mapping == {1: 1, 2: 2, 3: 3, 4: 3}
+    for string in ['', 'a', 'ab', 'ba', 'aaabbbaaa', 'bbbbbbbbaa', 'abab']:
+        assert minimal_design.is_accepts(string) == redundant_design.is_accepts(string)
+    assert dfa_desgin.minimize()[0].state_count() == 3
+    # state 2 can never reach an accept state, so it is merged into the dead sink
+    trapped_design = DFADesign(1, [1], DFARulebook([FARule(1, 'a', 1), FARule(1, 'b', 2), FARule(2, 'a', 2)]))
+    assert trapped_design.minimize()[1] == {1: 1, 2: DFARulebook.DEAD_STATE}
+
+    print('-' * 20)
+    # every digit behaves the same way, so the ten digits share one column of the table
+    digits_rulebook = DFARulebook(
+        [FARule(1, digit, 2) for digit in '0123456789'] +
+        [FARule(2, digit, 2) for digit in '0123456789'] +
+        [FARule(2, '.', 3)] +
+        [FARule(3, digit, 4) for digit in '0123456789'] +
+        [FARule(4, digit, 4) for digit in '0123456789']
+    ).compile()
+    assert digits_rulebook.width == 3
+    assert len(set(digits_rulebook.character_classes[digit] for digit in '0123456789')) == 1
+    assert DFADesign(1, [2, 4], digits_rulebook).is_accepts('3.14')
+    assert not DFADesign(1, [2, 4], digits_rulebook).is_accepts('3.')
+    ranges = digits_rulebook.class_ranges()
+    assert ranges == ([0, ord('.'), ord('.') + 1, ord('0'), ord('9') + 1], [2, 1, 2, 0, 2])
+    assert class_for_code_point(ranges, ord('7')) == digits_rulebook.character_classes['7']
+    assert class_for_code_point(ranges, 0x1F600) == digits_rulebook.unknown_class
+    assert list(DFADesign(1, [2, 4], digits_rulebook).is_accepts_many(['3.14', '42', '4x2', '.5'])) == \
+        [True, True, False, False]
+
+    print('-' * 20)
+    # a DFA for the pattern ab+
+    ab_design = DFADesign(1, [3], DFARulebook([
+        FARule(1, 'a', 2), FARule(2, 'b', 3), FARule(3, 'b', 3),
+    ]))
+    assert ab_design.search('xxaxabbyab') == (4, 6)
+    assert list(ab_design.find_all('xxaxabbyab')) == [(4, 6), (4, 7), (8, 10)]
+    assert list(ab_design.compiled().find_all(iter('xxaxabbyab'))) == [(4, 6), (4, 7), (8, 10)]
+    assert ab_design.search('aaaa') is None
@@ -0,0 +1,152 @@
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dfa import FARule, DFARulebook, DFADesign
+from dfa_stream import DFAStream
+
+# byte table of the stream being scanned, installed once per worker process
+worker_byte_table = None
+
+
+def init_worker(byte_table):
+    global worker_byte_table
+    worker_byte_table = byte_table
+
+
+MERGE_BLOCK = 4096
+
+
+def chunk_mapping(byte_table, state_count, chunk):
+    """Run a chunk from every state, return the row offset each start state ends at"""
+    # states that loop to themselves on every byte (like the dead state) are finished as soon as reached
+    absorbing = set(offset for offset in range(0, state_count * 256, 256)
+                    if all(byte_table[offset + byte] == offset for byte in range(256)))
+    ends = list(range(0, state_count * 256, 256))
+    groups = {offset: [offset // 256] for offset in ends if offset not in absorbing}
+    for start in range(0, len(chunk), MERGE_BLOCK):
+        if len(groups) <= 1:
+            break
+        block = chunk[start:start + MERGE_BLOCK]
+        # runs that reached the same state by the end of a block stay together from here on
+        merged = {}
+        for old_offset, origins in groups.items():
+            offset = old_offset
+            for byte in block:
+                offset = byte_table[offset + byte]
+            merged.setdefault(offset, []).extend(origins)
+        groups = {}
+        for offset, origins in merged.items():
+            if offset in absorbing:
+                for origin in origins:
+                    ends[origin] = offset
+            else:
+                groups[offset] = origins
+    else:
+        start = len(chunk)
+    for offset, origins in groups.items():
+        # at most one run is left here unless the chunk ran out, finish it like a serial scan
+        for byte in chunk[start:]:
+            offset = byte_table[offset + byte]
+        for origin in origins:
+            ends[origin] = offset
+    return ends
+
+
+def scan_bytes(chunk):
+    return chunk_mapping(worker_byte_table, len(worker_byte_table) // 256, chunk)
+
+
+def scan_file_range(path, start, end):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return scan_bytes(mapped[start:end])
+
+
+class ParallelDFAScanner:
+    """Splits input into chunks, maps each chunk from every state in a worker process,
+    then composes the mappings in order to find the final state"""
+    def __init__(self, dfa_design, workers=None, chunk_size=1 << 22):
+        self.dfa_design = dfa_design
+        self.stream = DFAStream(dfa_design.start_state, dfa_design.accept_states, dfa_design.rulebook)
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+
+    def compose(self, mappings):
+        offset = self.stream.offset
+        for mapping in mappings:
+            offset = mapping[offset // 256]
+        return self.stream.states[offset // 256]
+
+    def read_bytes(self, data):
+        chunks = [data[start:start + self.chunk_size] for start in range(0, len(data), self.chunk_size)]
+        with ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self.stream.byte_table,)) as pool:
+            return self.compose(pool.map(scan_bytes, chunks))
+
+    def read_file(self, path):
+        size = os.path.getsize(path)
+        ranges = [(start, min(start + self.chunk_size, size)) for start in range(0, size, self.chunk_size)]
+        with ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self.stream.byte_table,)) as pool:
+            futures = [pool.submit(scan_file_range, path, start, end) for start, end in ranges]
+            return self.compose(future.result() for future in futures)
+
+    def is_accepts_bytes(self, data):
+        return self.read_bytes(data) in self.dfa_design.accept_states
+
+    def is_accepts_file(self, path):
+        return self.read_file(path) in self.dfa_design.accept_states
+
+
+def benchmark(dfa_design, sizes=(1 << 14, 1 << 17, 1 << 20, 1 << 23), workers=None):
+    print(f'{"bytes":>10} {"serial s":>10} {"parallel s":>11}')
+    for size in sizes:
+        data = os.urandom(size).translate(bytes(b'ab'[byte & 1] for byte in range(256)))
+        start = time.perf_counter()
+        stream = DFAStream(dfa_design.start_state, dfa_design.accept_states, dfa_design.rulebook)
+        stream.feed(data)
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scanner = ParallelDFAScanner(dfa_design, workers, chunk_size=max(size // (workers or os.cpu_count()), 1))
+        state = scanner.read_bytes(data)
+        parallel = time.perf_counter() - start
+        assert state == stream.current_state
+        print(f'{size:>10} {serial:>10.4f} {parallel:>11.4f}')
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    rulebook = DFARulebook([
+        FARule(1, 'a', 2), FARule(1, 'b', 1),
+        FARule(2, 'a', 2), FARule(2, 'b', 3),
+        FARule(3, 'a', 3), FARule(3, 'b', 3)
+    ])
+    dfa_design = DFADesign(1, [3], rulebook)
+
+    print('-' * 20)
+    stream = DFAStream(1, [3], rulebook)
+    assert [offset // 256 for offset in chunk_mapping(stream.byte_table, 4, b'b')] == [0, 2, 2, 3]
+    assert [offset // 256 for offset in chunk_mapping(stream.byte_table, 4, b'x')] == [3, 3, 3, 3]
+
+    print('-' * 20)
+    scanner = ParallelDFAScanner(dfa_design, workers=2, chunk_size=5)
+    assert scanner.is_accepts_bytes(b'bbbbbbbbbbbbbabbbb')
+    assert not scanner.is_accepts_bytes(b'bbbbbbbbbbbbbaaaaa')
+    assert scanner.is_accepts_bytes(b'bbbba' + b'bbbbb')
+    assert not scanner.is_accepts_bytes(b'')
+
+    print('-' * 20)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'input')
+        with open(path, 'wb') as f:
+            f.write(b'b' * 1000 + b'ab')
+        assert ParallelDFAScanner(dfa_design, workers=2, chunk_size=300).is_accepts_file(path)
+
+    if sys.argv[1:] == ['benchmark']:
+        # counting a's modulo 3 never converges, so every chunk has to be run from all three states
+        benchmark(DFADesign(0, [0], DFARulebook([
+            FARule(0, 'a', 1), FARule(1, 'a', 2), FARule(2, 'a', 0),
+            FARule(0, 'b', 0), FARule(1, 'b', 1), FARule(2, 'b', 2),
+        ])))
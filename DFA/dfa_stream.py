@@ -0,0 +1,138 @@
+import mmap
+from array import array
+
+from dfa import FARule, DFARulebook, DFADesign
+
+
+class DFAStream:
+    """Resumable DFA run over a stream of byte chunks"""
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, start_state, accept_states, rulebook):
+        self.rulebook = rulebook.compile()
+        self.accept_states = accept_states
+        # next-state table indexed directly by byte value, each entry is the row offset of
+        # the next state so the inner loop is a single add and index per byte
+        rulebook = self.rulebook
+        byte_classes = [rulebook.unknown_class] * 256
+        for character, character_class in rulebook.character_classes.items():
+            byte_classes[self.byte_for(character)] = character_class
+        self.states = list(rulebook.states)
+        if start_state not in rulebook.state_ids:
+            # a start state that appears in no rule gets a row of its own, so it is still the
+            # current state before any input and goes dead on the first byte
+            self.states.append(start_state)
+        self.byte_table = array('l', [rulebook.dead_state_id * 256]) * (len(self.states) * 256)
+        for state_id in range(len(rulebook.states)):
+            row = state_id * rulebook.width
+            for byte in range(256):
+                next_state_id = rulebook.table[row + byte_classes[byte]]
+                self.byte_table[state_id * 256 + byte] = next_state_id * 256
+        self.offset = rulebook.state_ids.get(start_state, len(rulebook.states)) * 256
+
+    @staticmethod
+    def byte_for(character):
+        """The byte a rule character stands for: an int below 256, a single byte, or an ASCII
+        character, since any other character has no single byte in UTF-8 input"""
+        if isinstance(character, int) and 0 <= character < 256:
+            return character
+        if isinstance(character, bytes) and len(character) == 1:
+            return character[0]
+        if isinstance(character, str) and len(character) == 1 and ord(character) < 128:
+            return ord(character)
+        raise ValueError(f'rule character {character!r} is not a byte or an ASCII character')
+
+    @property
+    def current_state(self):
+        return self.states[self.offset // 256]
+
+    def is_accepting(self):
+        return self.current_state in self.accept_states
+
+    def feed(self, chunk):
+        byte_table, offset = self.byte_table, self.offset
+        for byte in chunk:
+            offset = byte_table[offset + byte]
+        self.offset = offset
+        return self.current_state
+
+    def feed_chunks(self, chunks):
+        for chunk in chunks:
+            self.feed(chunk)
+        return self.current_state
+
+    def feed_file(self, path, chunk_size=CHUNK_SIZE):
+        with open(path, 'rb') as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file cannot be mapped
+                return self.current_state
+            with mapped:
+                for start in range(0, len(mapped), chunk_size):
+                    self.feed(mapped[start:start + chunk_size])
+        return self.current_state
+
+
+def to_stream(dfa_design):
+    return DFAStream(dfa_design.start_state, dfa_design.accept_states, dfa_design.rulebook)
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    rulebook = DFARulebook([
+        FARule(1, 'a', 2), FARule(1, 'b', 1),
+        FARule(2, 'a', 2), FARule(2, 'b', 3),
+        FARule(3, 'a', 3), FARule(3, 'b', 3)
+    ])
+    dfa_design = DFADesign(1, [3], rulebook)
+
+    print('-' * 20)
+    stream = to_stream(dfa_design)
+    assert not stream.is_accepting()
+    stream.feed(b'bba')
+    assert not stream.is_accepting()
+    assert stream.current_state == 2
+    stream.feed(b'b')
+    assert stream.is_accepting()
+
+    print('-' * 20)
+    stream = to_stream(dfa_design)
+    stream.feed_chunks([b'bbb', b'', b'aa', b'ab'])
+    assert stream.is_accepting()
+    stream = to_stream(dfa_design)
+    stream.feed_chunks([b'ab', b'x'])
+    assert stream.current_state == DFARulebook.DEAD_STATE
+
+    print('-' * 20)
+    # a start state without rules accepts the empty input and nothing else
+    lonely = DFADesign(0, [0, 2], DFARulebook([FARule(1, 'a', 2)]))
+    stream = to_stream(lonely)
+    stream.feed(b'')
+    assert stream.current_state == 0 and stream.is_accepting() == lonely.is_accepts('')
+    stream.feed(b'a')
+    assert stream.current_state == DFARulebook.DEAD_STATE and not stream.is_accepting()
+    assert to_stream(DFADesign(1, [2], DFARulebook([FARule(1, 0xe9, 2), FARule(1, b'a', 2)]))).feed(b'\xe9') == 2
+    for character in ('\xe9', 'ab', 256):
+        try:
+            to_stream(DFADesign(1, [2], DFARulebook([FARule(1, character, 2)])))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f'{character!r} should not be a byte')
+
+    print('-' * 20)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'input')
+        with open(path, 'wb') as f:
+            f.write(b'b' * 100000 + b'a' + b'b')
+        stream = to_stream(dfa_design)
+        stream.feed_file(path, chunk_size=4096)
+        assert stream.is_accepting()
+
+        open(path, 'wb').close()
+        stream = to_stream(dfa_design)
+        stream.feed_file(path)
+        assert not stream.is_accepting()
@@ -1,3 +1,14 @@
+import ast
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from random import Random
+
+
 class Tape:
     """Purely functional non-destructive tape"""
     def __init__(self, left, middle, right, blank):
@@ -10,6 +21,9 @@ class Tape:
         left = ''.join(self.left)
         right = ''.join(self.right)
         return f'<Tape {left}({self.middle}){right}>'
+
+    def __len__(self):
+        return len(self.left) + 1 + len(self.right)
     
     def write(self, character):
         return Tape(self.left, character, self.right, self.blank)
@@ -27,6 +41,207 @@ class Tape:
         return Tape(left, middle, right, self.blank)
     
 
+class ArrayTape:
+    """Mutable tape: a list of cells that grows into blank space at either end, and an integer head.
+    write and moves change the tape in place and return it, so it can stand in for Tape"""
+    def __init__(self, left, middle, right, blank):
+        self.cells = list(left) + [middle] + list(right)
+        self.head = len(left)
+        self.blank = blank
+        # the cells the tape has actually visited, printed the same way as Tape
+        self.start = 0
+        self.end = len(self.cells)
+
+    @staticmethod
+    def from_tape(tape):
+        return ArrayTape(tape.left, tape.middle, tape.right, tape.blank)
+
+    def to_tape(self):
+        """Snapshot as a purely functional Tape"""
+        return Tape(self.cells[self.start:self.head], self.cells[self.head],
+                    self.cells[self.head + 1:self.end], self.blank)
+
+    @property
+    def middle(self):
+        return self.cells[self.head]
+
+    def __str__(self):
+        left = ''.join(self.cells[self.start:self.head])
+        right = ''.join(self.cells[self.head + 1:self.end])
+        return f'<Tape {left}({self.middle}){right}>'
+
+    def __len__(self):
+        return self.end - self.start
+
+    def write(self, character):
+        self.cells[self.head] = character
+        return self
+
+    def move_head_left(self):
+        if self.head == 0:
+            # double the tape to the left so growth is amortised O(1)
+            grown = max(len(self.cells), 8)
+            self.cells[:0] = [self.blank] * grown
+            self.head += grown
+            self.start += grown
+            self.end += grown
+        self.head -= 1
+        self.start = min(self.start, self.head)
+        return self
+
+    def move_head_right(self):
+        self.head += 1
+        if self.head == len(self.cells):
+            self.cells.extend([self.blank] * max(len(self.cells), 8))
+        self.end = max(self.end, self.head + 1)
+        return self
+
+
+class RLETape:
+    """Mutable run-length encoded tape: runs of equal cells in parallel symbols and counts lists, and
+    the head as a run index and an offset into that run. A long run of one symbol costs one entry"""
+    def __init__(self, left, middle, right, blank):
+        self.symbols = []
+        self.counts = []
+        for char in list(left) + [middle] + list(right):
+            if self.symbols and self.symbols[-1] == char:
+                self.counts[-1] += 1
+            else:
+                self.symbols.append(char)
+                self.counts.append(1)
+        self.blank = blank
+        self.size = len(left) + 1 + len(right)
+        self.run, self.offset = 0, len(left)
+        while self.offset >= self.counts[self.run]:
+            self.offset -= self.counts[self.run]
+            self.run += 1
+
+    @staticmethod
+    def from_runs(symbols, counts, run, offset, blank):
+        tape = RLETape.__new__(RLETape)
+        tape.symbols, tape.counts, tape.run, tape.offset, tape.blank = symbols, counts, run, offset, blank
+        tape.size = sum(counts)
+        return tape
+
+    @staticmethod
+    def from_tape(tape):
+        return RLETape(tape.left, tape.middle, tape.right, tape.blank)
+
+    def to_tape(self):
+        cells = [symbol for symbol, count in zip(self.symbols, self.counts) for _ in range(count)]
+        head = sum(self.counts[:self.run]) + self.offset
+        return Tape(cells[:head], cells[head], cells[head + 1:], self.blank)
+
+    @property
+    def middle(self):
+        return self.symbols[self.run]
+
+    def __str__(self):
+        return str(self.to_tape())
+
+    def __len__(self):
+        return self.size
+
+    def write(self, character):
+        symbols, counts, run = self.symbols, self.counts, self.run
+        symbol = symbols[run]
+        if symbol == character:
+            return self
+        # split the head cell off its run, then merge it with equal neighbours
+        after = counts[run] - self.offset - 1
+        pieces = [(symbol, self.offset)] if self.offset else []
+        pieces.append((character, 1))
+        if after:
+            pieces.append((symbol, after))
+        symbols[run:run + 1] = [piece[0] for piece in pieces]
+        counts[run:run + 1] = [piece[1] for piece in pieces]
+        run += len(pieces) - 1 - (after > 0)
+        offset = 0
+        if run + 1 < len(symbols) and symbols[run + 1] == character:
+            counts[run] += counts[run + 1]
+            del symbols[run + 1], counts[run + 1]
+        if run > 0 and symbols[run - 1] == character:
+            offset = counts[run - 1]
+            counts[run - 1] += counts[run]
+            del symbols[run], counts[run]
+            run -= 1
+        self.run, self.offset = run, offset
+        return self
+
+    def move_head_left(self):
+        if self.offset:
+            self.offset -= 1
+        elif self.run:
+            self.run -= 1
+            self.offset = self.counts[self.run] - 1
+        else:
+            self.size += 1
+            if self.symbols[0] == self.blank:
+                self.counts[0] += 1
+            else:
+                self.symbols.insert(0, self.blank)
+                self.counts.insert(0, 1)
+        return self
+
+    def move_head_right(self):
+        if self.offset + 1 < self.counts[self.run]:
+            self.offset += 1
+        elif self.run + 1 < len(self.symbols):
+            self.run += 1
+            self.offset = 0
+        else:
+            self.size += 1
+            if self.symbols[-1] == self.blank:
+                self.counts[-1] += 1
+                self.offset += 1
+            else:
+                self.symbols.append(self.blank)
+                self.counts.append(1)
+                self.run += 1
+                self.offset = 0
+        return self
+
+    def skip(self, skipped, move, limit=None):
+        """Move the head in direction move past every cell from the head on whose symbol is in skipped,
+        a whole run at a time, but no more than limit cells. Returns the number of cells crossed"""
+        symbols, counts, run = self.symbols, self.counts, self.run
+        if move > 0:
+            crossed = counts[run] - self.offset
+            run += 1
+            while run < len(symbols) and symbols[run] in skipped and (limit is None or crossed < limit):
+                crossed += counts[run]
+                run += 1
+        else:
+            crossed = self.offset + 1
+            run -= 1
+            while run >= 0 and symbols[run] in skipped and (limit is None or crossed < limit):
+                crossed += counts[run]
+                run -= 1
+        if limit is not None:
+            crossed = min(crossed, limit)
+        self.advance(crossed * move)
+        return crossed
+
+    def advance(self, distance):
+        """Move the head distance cells, right when it is positive, a run at a time"""
+        while distance > 0:
+            room = self.counts[self.run] - self.offset - 1
+            if distance <= room:
+                self.offset += distance
+                return self
+            distance -= room + 1
+            self.offset = self.counts[self.run] - 1
+            self.move_head_right()
+        while distance < 0:
+            if -distance <= self.offset:
+                self.offset += distance
+                return self
+            distance += self.offset + 1
+            self.offset = 0
+            self.move_head_left()
+        return self
+
+
 class TMConfiguration:
     def __init__(self, state, tape):
         self.state = state
@@ -75,26 +290,600 @@ class DTMRulebook:
     def is_applies_to(self, configuration):
         return self.rule_for(configuration) is not None
 
+    def run(self, configuration, accept_states, max_steps=None, max_tape=None):
+        """Follow rules until an accept state or a stuck configuration, after max_steps steps, or once
+        the tape grows past max_tape cells. Returns the last configuration and the number of steps"""
+        if max_tape is not None:
+            max_tape = max(max_tape, len(configuration.tape))
+        steps = 0
+        while configuration.state not in accept_states and (max_steps is None or steps < max_steps):
+            rule = self.rule_for(configuration)
+            if rule is None:
+                break
+            configuration = rule.follow(configuration)
+            steps += 1
+            if max_tape is not None and len(configuration.tape) > max_tape:
+                break
+        return configuration, steps
+
+    def self_loops(self):
+        """{(state, character): direction} for rules that leave both the cell and the state unchanged.
+        A run of such cells is crossed without anything else happening, so it can be one macro step"""
+        res = {}
+        seen = set()
+        for rule in self.rules:
+            key = (rule.state, rule.character)
+            if key not in seen:
+                seen.add(key)
+                if rule.next_state == rule.state and rule.write_character == rule.character:
+                    res[key] = rule.direction
+        return res
+
+    def compile(self, macro_steps=True):
+        return CompiledDTMRulebook(self.rules, macro_steps)
+
+
+class CompiledDTMRulebook:
+    """Rules numbered into a flat dispatch table. Entry state_id * width + symbol_id holds
+    (write symbol id, move, state_id * width of the next state), or None where the machine halts.
+    With macro_steps, non-writing self-loops are taken out of the table and crossed in one jump"""
+    MOVES = {'left': -1, 'right': 1}
+
+    def __init__(self, rules, macro_steps=True):
+        self.rules = rules
+        self.macro_steps = macro_steps
+        self.states = []
+        self.state_ids = {}
+        self.symbols = []
+        self.symbol_ids = {}
+        self.index = {}
+        for rule in rules:
+            if rule.direction not in self.MOVES:
+                raise AttributeError(f'expected string \'left\' or \'right\' as direction, {rule.direction} countered')
+            self.state_id(rule.state)
+            self.state_id(rule.next_state)
+            self.symbol_id(rule.character)
+            self.symbol_id(rule.write_character)
+            # the first matching rule wins, as in DTMRulebook.rule_for
+            self.index.setdefault((rule.state, rule.character), rule)
+        self.tables = {}
+
+    def state_id(self, state):
+        if state not in self.state_ids:
+            self.state_ids[state] = len(self.states)
+            self.states.append(state)
+        return self.state_ids[state]
+
+    def symbol_id(self, symbol):
+        if symbol not in self.symbol_ids:
+            self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return self.symbol_ids[symbol]
+
+    def rule_for(self, configuration):
+        return self.index.get((configuration.state, configuration.tape.middle))
+
+    def next_configuration(self, configuration):
+        return self.rule_for(configuration).follow(configuration)
+
+    def is_applies_to(self, configuration):
+        return self.rule_for(configuration) is not None
+
+    def symbol_table(self, characters):
+        """Symbol ids extended with the characters the rulebook has never seen, in id order"""
+        symbol_ids = dict(self.symbol_ids)
+        for char in characters:
+            symbol_ids.setdefault(char, len(symbol_ids))
+        return list(symbol_ids), symbol_ids
+
+    def table(self, accept_ids, width, macro_steps):
+        """Dispatch table for tapes numbered with width symbol ids, ids past the rulebook's own
+        symbols have no rules. Rows of accept states are empty so that the machine halts there.
+        Jumps maps the entries of self-loops to (move, ids crossed, every other id)"""
+        key = (accept_ids, width, macro_steps)
+        if key not in self.tables:
+            table = [None] * (len(self.states) * width)
+            for (state, character), rule in self.index.items():
+                state_id = self.state_ids[state]
+                if state_id not in accept_ids:
+                    table[state_id * width + self.symbol_ids[character]] = (
+                        self.symbol_ids[rule.write_character], self.MOVES[rule.direction],
+                        self.state_ids[rule.next_state] * width)
+            jumps = {}
+            self_loops = DTMRulebook(self.rules).self_loops() if macro_steps else {}
+            for (state, character), direction in self_loops.items():
+                state_id = self.state_ids[state]
+                if state_id not in accept_ids:
+                    skipped = frozenset(self.symbol_ids[other] for (other_state, other), other_direction
+                                        in self_loops.items() if other_state == state and other_direction == direction)
+                    stops = tuple(symbol_id for symbol_id in range(width) if symbol_id not in skipped)
+                    table[state_id * width + self.symbol_ids[character]] = None
+                    jumps[state_id * width + self.symbol_ids[character]] = (self.MOVES[direction], skipped, stops)
+            self.tables[key] = table, jumps
+        return self.tables[key]
+
+    def run(self, configuration, accept_states, max_steps=None, max_tape=None):
+        state = configuration.state
+        if state in accept_states or state not in self.state_ids or max_steps == 0:
+            return configuration, 0
+        accept_ids = frozenset(self.state_ids[state] for state in accept_states if state in self.state_ids)
+        max_steps = sys.maxsize if max_steps is None else max_steps
+        max_tape = sys.maxsize if max_tape is None else max(max_tape, len(configuration.tape))
+        if isinstance(configuration.tape, RLETape):
+            return self.run_runs(configuration, accept_ids, max_steps, max_tape)
+        return self.run_cells(configuration, accept_ids, max_steps, max_tape)
+
+    def run_cells(self, configuration, accept_ids, max_steps, max_tape):
+        tape = configuration.tape
+        if isinstance(tape, ArrayTape):
+            tape = tape.to_tape()
+        symbols, symbol_ids = self.symbol_table(tape.left + [tape.middle] + tape.right + [tape.blank])
+        visited = [symbol_ids[char] for char in tape.left + [tape.middle] + tape.right]
+        blank = symbol_ids[tape.blank]
+        # unvisited cells hold the edge id, which has no rules, so the inner loop needs no bounds checks
+        edge = len(symbols)
+        width = edge + 1
+        padding = max(len(visited), 64)
+        cells = [edge] * padding + visited + [edge] * padding
+        if width <= 256:
+            cells = bytearray(cells)
+        # a list has no find, so there self-loops are taken one step at a time
+        table, jumps = self.table(accept_ids, width, self.macro_steps and width <= 256)
+        start, end = padding, padding + len(visited)
+        head = padding + len(tape.left)
+        base = self.state_ids[configuration.state] * width
+        steps = 0
+        while steps < max_steps:
+            remaining = max_steps - steps
+            for taken in range(remaining):
+                entry = table[base + cells[head]]
+                if entry is None:
+                    break
+                cells[head], move, base = entry
+                head += move
+            else:
+                taken = remaining
+            steps += taken
+            cell = cells[head]
+            if cell == edge:
+                cells[head] = blank
+                if head < start:
+                    start = head
+                else:
+                    end = head + 1
+                if head == 0:
+                    padding = len(cells)
+                    cells[:0] = [edge] * padding
+                    head, start, end = head + padding, start + padding, end + padding
+                elif head == len(cells) - 1:
+                    cells.extend([edge] * len(cells))
+                if end - start > max_tape:
+                    break
+                continue
+            if steps == max_steps:
+                break
+            jump = jumps.get(base + cell)
+            if jump is None:
+                break
+            move, _, stops = jump
+            target = skip_cells(cells, head, move, stops, max_steps - steps)
+            steps += (target - head) * move
+            head = target
+        if cells[head] == edge:
+            # the last step left the visited cells
+            cells[head] = blank
+            start, end = min(start, head), max(end, head + 1)
+        left = [symbols[cell] for cell in cells[start:head]]
+        right = [symbols[cell] for cell in cells[head + 1:end]]
+        tape = type(configuration.tape)(left, symbols[cells[head]], right, tape.blank)
+        return TMConfiguration(self.states[base // width], tape), steps
+
+    def run_runs(self, configuration, accept_ids, max_steps, max_tape):
+        tape = configuration.tape
+        symbols, symbol_ids = self.symbol_table(tape.symbols + [tape.blank])
+        width = len(symbols)
+        table, jumps = self.table(accept_ids, width, self.macro_steps)
+        runs = RLETape.from_runs([symbol_ids[char] for char in tape.symbols], list(tape.counts),
+                                 tape.run, tape.offset, symbol_ids[tape.blank])
+        base = self.state_ids[configuration.state] * width
+        steps = 0
+        while steps < max_steps and runs.size <= max_tape:
+            cell = runs.symbols[runs.run]
+            entry = table[base + cell]
+            if entry is not None:
+                write, move, base = entry
+                runs.write(write)
+                if move > 0:
+                    runs.move_head_right()
+                else:
+                    runs.move_head_left()
+                steps += 1
+                continue
+            jump = jumps.get(base + cell)
+            if jump is None:
+                break
+            move, skipped, _ = jump
+            steps += runs.skip(skipped, move, max_steps - steps)
+        tape = RLETape.from_runs([symbols[cell] for cell in runs.symbols], runs.counts, runs.run, runs.offset, tape.blank)
+        return TMConfiguration(self.states[base // width], tape), steps
+
+    def compile(self):
+        return self
+
+
+def skip_cells(cells, head, move, stops, limit):
+    """Index of the first cell from head on in direction move that holds one of the stop ids, but
+    no more than limit cells away. Found with bytearray.find and rfind, each search bounded by the
+    nearest stop so far"""
+    if move > 0:
+        res = min(len(cells), head + limit + 1)
+        for stop in stops:
+            found = cells.find(stop, head, res)
+            if found != -1:
+                res = found
+        return min(res, head + limit)
+    res = max(-1, head - limit - 1)
+    for stop in stops:
+        found = cells.rfind(stop, res + 1, head + 1)
+        if found != -1:
+            res = found
+    return max(res, head - limit)
+
+
+class RunResult:
+    """How a bounded run ended. budget says which budget ran out: 'steps', 'tape' or 'deadline'"""
+    ACCEPTED = 'accepted'
+    STUCK = 'stuck'
+    BUDGET_EXHAUSTED = 'budget exhausted'
+    CYCLE_DETECTED = 'cycle detected'
+
+    def __init__(self, outcome, steps, configuration, budget=None):
+        self.outcome = outcome
+        self.steps = steps
+        self.configuration = configuration
+        self.budget = budget
+
+    def __str__(self):
+        budget = f' ({self.budget})' if self.budget else ''
+        return f'<RunResult {self.outcome}{budget}, steps={self.steps}>'
+
+
+def fingerprint(configuration):
+    """(state, head position, tape hash) and the cells, which confirm a match when the hashes agree"""
+    tape = configuration.tape
+    if not isinstance(tape, Tape):
+        tape = tape.to_tape()
+    cells = tuple(tape.left + [tape.middle] + tape.right)
+    return (configuration.state, len(tape.left), hash(cells)), cells
+
+
+SNAPSHOT_MAGIC = b'DTMSNAP1'
+# steps, head, cell count, crc32 of everything after the header, length of the literal, bytes per cell
+SNAPSHOT_HEADER = struct.Struct('<QQQIIB')
+
+
+def check_literal(value):
+    """repr of value, ValueError unless ast.literal_eval reads value back from it as decode_snapshot has to"""
+    text = repr(value)
+    try:
+        same = ast.literal_eval(text) == value
+    except Exception:
+        same = False
+    if not same:
+        raise ValueError(f'{text} is not a Python literal, so it cannot go in a DTM snapshot')
+    return text
+
+
+def encode_snapshot(state, tape, steps):
+    """Magic, header, then the state, the blank and the symbols as a Python literal, and every visited
+    cell as a symbol id in one byte, or in four when there are more than 256 symbols. ValueError if
+    the state or a symbol would not read back from its literal"""
+    if not isinstance(tape, Tape):
+        tape = tape.to_tape()
+    symbol_ids = {}
+    ids = [symbol_ids.setdefault(char, len(symbol_ids)) for char in tape.left + [tape.middle] + tape.right]
+    literal = check_literal((state, tape.blank, list(symbol_ids))).encode()
+    if len(symbol_ids) <= 256:
+        cell_size, cells = 1, bytes(ids)
+    else:
+        cell_ids = array('I', ids)
+        if sys.byteorder == 'big':
+            cell_ids.byteswap()
+        cell_size, cells = 4, cell_ids.tobytes()
+    payload = literal + cells
+    header = SNAPSHOT_HEADER.pack(steps, len(tape.left), len(ids), zlib.crc32(payload), len(literal), cell_size)
+    return SNAPSHOT_MAGIC + header + payload
+
+
+def decode_snapshot(data):
+    """(state, Tape, steps) from snapshot bytes, ValueError if they are not a whole snapshot"""
+    if not data.startswith(SNAPSHOT_MAGIC) or len(data) < len(SNAPSHOT_MAGIC) + SNAPSHOT_HEADER.size:
+        raise ValueError('not a DTM snapshot')
+    steps, head, count, crc, literal_size, cell_size = SNAPSHOT_HEADER.unpack_from(data, len(SNAPSHOT_MAGIC))
+    payload = data[len(SNAPSHOT_MAGIC) + SNAPSHOT_HEADER.size:]
+    if len(payload) != literal_size + count * cell_size or zlib.crc32(payload) != crc:
+        raise ValueError('DTM snapshot is truncated or corrupt')
+    try:
+        state, blank, symbols = ast.literal_eval(payload[:literal_size].decode())
+    except (SyntaxError, TypeError, ValueError):
+        raise ValueError('DTM snapshot does not hold a state and symbols') from None
+    ids = payload[literal_size:]
+    if cell_size == 4:
+        ids = array('I', ids)
+        if sys.byteorder == 'big':
+            ids.byteswap()
+    cells = [symbols[symbol_id] for symbol_id in ids]
+    return state, Tape(cells[:head], cells[head], cells[head + 1:], blank), steps
+
+
+def write_snapshot(path, data):
+    """Write to a file next to path and rename it over path, so a crash leaves the old snapshot whole"""
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+class Checkpointer:
+    """Saves a running DTM to path every steps steps or seconds seconds, whichever comes first.
+    With background the snapshot is encoded and written on a thread that always takes the newest
+    one, so the step loop only hands over the configuration (a copy, for the mutable tapes)"""
+    def __init__(self, path, steps=None, seconds=None, background=True):
+        self.path = path
+        self.steps = steps
+        self.seconds = seconds
+        self.background = background
+        self.last_steps = 0
+        self.last_time = time.monotonic()
+        self.saves = 0
+        self.condition = threading.Condition()
+        self.pending = None
+        self.writing = False
+        self.closing = False
+        self.error = None
+        self.thread = None
+        # values already known to round-trip through a snapshot
+        self.literals = set()
+
+    def start(self, dtm):
+        self.last_steps, self.last_time = dtm.steps, time.monotonic()
+
+    def steps_until_due(self, dtm):
+        if self.steps is None:
+            return sys.maxsize
+        return max(1, self.last_steps + self.steps - dtm.steps)
+
+    def is_due(self, dtm):
+        if self.steps is not None and dtm.steps - self.last_steps >= self.steps:
+            return True
+        return self.seconds is not None and time.monotonic() - self.last_time >= self.seconds
+
+    def save(self, dtm):
+        tape = dtm.current_configuration.tape
+        snapshot = (dtm.current_configuration.state, tape if isinstance(tape, Tape) else tape.to_tape(), dtm.steps)
+        self.last_steps, self.last_time = dtm.steps, time.monotonic()
+        self.saves += 1
+        if not self.background:
+            write_snapshot(self.path, encode_snapshot(*snapshot))
+            return
+        # a value that cannot be read back fails here in the run, not hours later on resume
+        state, tape, _ = snapshot
+        for value in {state, tape.blank, tape.middle}.union(tape.left, tape.right) - self.literals:
+            check_literal(value)
+            self.literals.add(value)
+        with self.condition:
+            self.pending = snapshot
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.write_pending, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def write_pending(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closing:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                snapshot, self.pending = self.pending, None
+                self.writing = True
+            try:
+                write_snapshot(self.path, encode_snapshot(*snapshot))
+            except Exception as error:
+                self.error = error
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def wait(self):
+        """Block until the newest snapshot is on disk, and raise what went wrong writing it"""
+        with self.condition:
+            while self.pending is not None or self.writing:
+                self.condition.wait()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self, dtm=None, raise_error=True):
+        """Save dtm a last time if given, stop the writer thread once everything is on disk, and raise
+        what went wrong writing unless raise_error is false"""
+        if dtm is not None:
+            try:
+                self.save(dtm)
+            except Exception as error:
+                self.error = error
+        if self.thread is not None:
+            with self.condition:
+                self.closing = True
+                self.condition.notify_all()
+            self.thread.join()
+            self.thread = None
+            self.closing = False
+        error, self.error = self.error, None
+        if error is not None and raise_error:
+            raise error
+
 
 class DTM:
+    # steps between deadline checks grow from SLICE_STEPS while a slice takes less than SLICE_SECONDS
+    SLICE_STEPS = 1024
+    SLICE_SECONDS = 0.01
+    CYCLE_STRIDE = 1024
+
     def __init__(self, current_configuration, accept_states, rulebook):
         self.current_configuration = current_configuration
         self.accept_states = accept_states
         self.rulebook = rulebook
+        self.steps = 0
     
     def is_accepting(self):
         return self.current_configuration.state in self.accept_states
     
     def step(self):
         self.current_configuration = self.rulebook.next_configuration(self.current_configuration)
+        self.steps += 1
     
-    def run(self):
-        while not self.is_accepting() and not self.is_stuck():
-            self.step()
+    def run(self, max_steps=None, max_tape=None, deadline=None, detect_cycles=False, cycle_stride=CYCLE_STRIDE,
+            checkpoint=None):
+        """Run until the machine accepts or gets stuck, or until a budget runs out: max_steps steps in
+        this run, the tape growing past max_tape cells, or time.monotonic() passing deadline.
+        With detect_cycles the configuration every cycle_stride steps goes through Brent's algorithm,
+        so a machine that repeats a configuration is stopped without storing every configuration.
+        A Checkpointer saves the machine while it runs, and once more when the run ends for any reason"""
+        if max_tape is not None:
+            max_tape = max(max_tape, len(self.current_configuration.tape))
+        steps = 0
+        slice_steps = cycle_stride if detect_cycles else self.SLICE_STEPS
+        # Brent: compare with the configuration saved at the last power of two, save again when lam reaches power
+        saved = None
+        power = lam = 1
+        if checkpoint is not None:
+            checkpoint.start(self)
+        interrupted = False
+        try:
+            while True:
+                limit = None if max_steps is None else max_steps - steps
+                if deadline is not None or detect_cycles or checkpoint is not None:
+                    limit = slice_steps if limit is None else min(limit, slice_steps)
+                    if checkpoint is not None and not detect_cycles:
+                        limit = min(limit, checkpoint.steps_until_due(self))
+                started = time.monotonic()
+                self.current_configuration, taken = self.rulebook.run(
+                    self.current_configuration, self.accept_states, limit, max_tape)
+                steps += taken
+                self.steps += taken
+                if self.is_accepting():
+                    return RunResult(RunResult.ACCEPTED, steps, self.current_configuration)
+                if self.is_stuck():
+                    return RunResult(RunResult.STUCK, steps, self.current_configuration)
+                if max_tape is not None and len(self.current_configuration.tape) > max_tape:
+                    return RunResult(RunResult.BUDGET_EXHAUSTED, steps, self.current_configuration, 'tape')
+                if max_steps is not None and steps >= max_steps:
+                    return RunResult(RunResult.BUDGET_EXHAUSTED, steps, self.current_configuration, 'steps')
+                if deadline is not None and time.monotonic() >= deadline:
+                    return RunResult(RunResult.BUDGET_EXHAUSTED, steps, self.current_configuration, 'deadline')
+                if checkpoint is not None and checkpoint.is_due(self):
+                    checkpoint.save(self)
+                if detect_cycles:
+                    current = fingerprint(self.current_configuration)
+                    if current == saved:
+                        return RunResult(RunResult.CYCLE_DETECTED, steps, self.current_configuration)
+                    if saved is None or power == lam:
+                        saved = current
+                        power *= 2
+                        lam = 0
+                    lam += 1
+                elif time.monotonic() - started < self.SLICE_SECONDS:
+                    slice_steps *= 2
+        except BaseException:
+            interrupted = True
+            raise
+        finally:
+            # a failed last write does not hide the exception that ended the run
+            if checkpoint is not None:
+                checkpoint.close(self, raise_error=not interrupted)
+
+    def save(self, path):
+        write_snapshot(path, encode_snapshot(self.current_configuration.state, self.current_configuration.tape, self.steps))
+
+    def load(self, path):
+        """Replace the configuration and step count with the snapshot at path, keeping the kind of tape"""
+        with open(path, 'rb') as file:
+            state, tape, steps = decode_snapshot(file.read())
+        current_tape = self.current_configuration.tape
+        if not isinstance(current_tape, Tape):
+            tape = type(current_tape).from_tape(tape)
+        self.current_configuration = TMConfiguration(state, tape)
+        self.steps = steps
+
+    def resume(self, path, **run_options):
+        """Load the snapshot at path and run on from it, run_options are passed to run"""
+        self.load(path)
+        return self.run(**run_options)
+
+    def compiled(self):
+        return DTM(self.current_configuration, self.accept_states, self.rulebook.compile())
         
     def is_stuck(self):
         return not self.is_accepting() and not self.rulebook.is_applies_to(self.current_configuration)
 
+
+def abc_rulebook():
+    """The machine from the book, from state 1 it accepts in state 6 strings like 'aaabbbccc', 'aabbcc'"""
+    return DTMRulebook([
+        # state 1: scan right looking for a
+        TMRule(1, 'X', 1, 'X', 'right'), # skip X
+        TMRule(1, 'a', 2, 'X', 'right'), # cross out a, go to state 2
+        TMRule(1, '_', 6, '_', 'left'),  # find blank, go to state 6 (accept)
+
+        # state 2: scan right looking for b
+        TMRule(2, 'a', 2, 'a', 'right'), # skip a
+        TMRule(2, 'X', 2, 'X', 'right'), # skip X
+        TMRule(2, 'b', 3, 'X', 'right'), # cross out b, go to state 3
+
+        # state 3: scan right looking for c
+        TMRule(3, 'b', 3, 'b', 'right'), # skip b
+        TMRule(3, 'X', 3, 'X', 'right'), # skip X
+        TMRule(3, 'c', 4, 'X', 'right'),  # cross out c, go to state 4
+    
+        # state 4: scan right looking for end of string
+        TMRule(4, 'c', 4, 'c', 'right'), # skip c
+        TMRule(4, '_', 5, '_', 'left'),  # find blank, go to state 5
+
+        # state 5: scan left looking for beginning of string
+        TMRule(5, 'a', 5, 'a', 'left'),  # skip a
+        TMRule(5, 'b', 5, 'b', 'left'),  # skip b
+        TMRule(5, 'c', 5, 'c', 'left'),  # skip c
+        TMRule(5, 'X', 5, 'X', 'left'),  # skip X
+        TMRule(5, '_', 1, '_', 'right'), # find blank, go to state 1
+    ])
+
+
+def benchmark(sizes=(10, 30, 100, 1000, 33334)):
+    rulebook = abc_rulebook()
+    engines = [
+        ('tape', rulebook, Tape, 100), ('array', rulebook, ArrayTape, 100),
+        ('compiled', rulebook.compile(macro_steps=False), Tape, 1000),
+        ('macro', rulebook.compile(), Tape, 33334), ('macro rle', rulebook.compile(), RLETape, 33334),
+    ]
+    print(f'{"n":>6} {"steps":>11} ' + ' '.join(f'{name + " steps/s":>18}' for name, _, _, _ in engines))
+    for size in sizes:
+        string = 'a' * size + 'b' * size + 'c' * size
+        rates = []
+        for _, engine_rulebook, tape_class, max_size in engines:
+            if size > max_size:
+                rates.append('-')
+                continue
+            dtm = DTM(TMConfiguration(1, tape_class([], string[0], list(string[1:]), '_')), [6], engine_rulebook)
+            start = time.perf_counter()
+            dtm.run()
+            rates.append(f'{dtm.steps / (time.perf_counter() - start):.0f}')
+            assert dtm.is_accepting()
+        print(f'{size:>6} {dtm.steps:>11} ' + ' '.join(f'{rate:>18}' for rate in rates))
+
+
 if __name__ == "__main__":
 
     tape = Tape(['1', '0', '1'], '1', [], '_')
@@ -145,34 +934,7 @@ if __name__ == "__main__":
     assert dtm.is_stuck()
     assert str(dtm.current_configuration) == '<TMConfiguration state=1, tape=<Tape 1(2)00>>'
 
-    # A Turing machine for recognizing strings like 'aaabbbccc', 'aabbcc'
-    test_rulebook = DTMRulebook([
-        # state 1: scan right looking for a
-        TMRule(1, 'X', 1, 'X', 'right'), # skip X
-        TMRule(1, 'a', 2, 'X', 'right'), # cross out a, go to state 2
-        TMRule(1, '_', 6, '_', 'left'),  # find blank, go to state 6 (accept)
-
-        # state 2: scan right looking for b
-        TMRule(2, 'a', 2, 'a', 'right'), # skip a
-        TMRule(2, 'X', 2, 'X', 'right'), # skip X
-        TMRule(2, 'b', 3, 'X', 'right'), # cross out b, go to state 3
-
-        # state 3: scan right looking for c
-        TMRule(3, 'b', 3, 'b', 'right'), # skip b
-        TMRule(3, 'X', 3, 'X', 'right'), # skip X
-        TMRule(3, 'c', 4, 'X', 'right'),  # cross out c, go to state 4
-        
-        # state 4: scan right looking for end of string
-        TMRule(4, 'c', 4, 'c', 'right'), # skip c
-        TMRule(4, '_', 5, '_', 'left'),  # find blank, go to state 5
-
-        # state 5: scan left looking for beginning of string
-        TMRule(5, 'a', 5, 'a', 'left'),  # skip a
-        TMRule(5, 'b', 5, 'b', 'left'),  # skip b
-        TMRule(5, 'c', 5, 'c', 'left'),  # skip c
-        TMRule(5, 'X', 5, 'X', 'left'),  # skip X
-        TMRule(5, '_', 1, '_', 'right'), # find blank, go to state 1
-    ])
+    test_rulebook = abc_rulebook()
 
     test_tape = Tape([], 'a', ['a', 'a', 'b', 'b', 'b', 'c', 'c', 'c'], '_')
     assert str(test_tape) == '<Tape (a)aabbbccc>'
@@ -193,4 +955,263 @@ if __name__ == "__main__":
     test_tape = Tape([], 'a', ['a', 'b', 'b', 'c', 'c'], '_')
     dtm = DTM(TMConfiguration(1, test_tape), [6], test_rulebook)
     dtm.run()
-    assert dtm.is_accepting()
\ No newline at end of file
+    assert dtm.is_accepting()
+
+    array_tape = ArrayTape(['1', '0', '1'], '1', [], '_')
+    assert str(array_tape) == '<Tape 101(1)>'
+    assert str(array_tape.move_head_left()) == '<Tape 10(1)1>'
+    assert str(array_tape.move_head_right().move_head_right()) == '<Tape 1011(_)>'
+    assert str(array_tape.write('0')) == '<Tape 1011(0)>'
+    for _ in range(6):
+        array_tape.move_head_left()
+    assert str(array_tape) == '<Tape (_)_10110>'
+    assert str(array_tape.to_tape()) == '<Tape (_)_10110>'
+    assert str(array_tape.to_tape().move_head_right()) == '<Tape _(_)10110>'
+
+    test_tape = Tape([], 'a', ['a', 'a', 'b', 'b', 'b', 'c', 'c', 'c'], '_')
+    dtm = DTM(TMConfiguration(1, ArrayTape.from_tape(test_tape)), [6], test_rulebook)
+    dtm.run()
+    assert dtm.is_accepting()
+    assert str(dtm.current_configuration) == '<TMConfiguration state=6, tape=<Tape _XXXXXXXX(X)_>>'
+
+    # a long walk is linear with the array tape, each step would copy the whole functional tape
+    walker = DTM(TMConfiguration(1, ArrayTape([], '_', [], '_')), [], DTMRulebook([TMRule(1, '_', 1, '1', 'left')]))
+    for _ in range(100000):
+        walker.step()
+    assert walker.current_configuration.tape.end - walker.current_configuration.tape.start == 100001
+
+    compiled = test_rulebook.compile()
+    for string, accepted in (('aaabbbccc', True), ('aabbcc', True), ('', True), ('aabbc', False), ('abcabc', False)):
+        plain = DTM(TMConfiguration(1, Tape([], (string or '_')[0], list(string[1:]), '_')), [6], test_rulebook)
+        plain.run()
+        fast = plain.compiled()
+        fast.current_configuration = TMConfiguration(1, Tape([], (string or '_')[0], list(string[1:]), '_'))
+        fast.run()
+        assert str(fast.current_configuration) == str(plain.current_configuration)
+        assert fast.steps == plain.steps and fast.is_accepting() == accepted
+        assert fast.is_stuck() != accepted
+
+    # tape symbols and blanks the rulebook has never seen, and an array tape
+    dtm = DTM(TMConfiguration(1, ArrayTape([], '1', ['1', '2'], ' ')), [3], rulebook.compile())
+    dtm.run()
+    assert str(dtm.current_configuration) == '<TMConfiguration state=1, tape=<Tape ( )012>>'
+    assert isinstance(dtm.current_configuration.tape, ArrayTape)
+    assert compiled.rule_for(TMConfiguration(2, Tape([], 'b', [], '_'))) is test_rulebook.rules[5]
+
+    # random machines agree with the rule by rule run wherever that halts
+    random = Random(0)
+    for _ in range(300):
+        rules = [TMRule(random.randrange(4), random.choice('01_'), random.randrange(4), random.choice('01_'),
+                        random.choice(['left', 'right'])) for _ in range(random.randrange(1, 10))]
+        string = ''.join(random.choice('01') for _ in range(random.randrange(1, 6)))
+        plain = DTM(TMConfiguration(0, Tape([], string[0], list(string[1:]), '_')), [3], DTMRulebook(rules))
+        for _ in range(200):
+            if plain.is_accepting() or plain.is_stuck():
+                break
+            plain.step()
+        else:
+            continue
+        fast = DTM(TMConfiguration(0, Tape([], string[0], list(string[1:]), '_')), [3], DTMRulebook(rules).compile())
+        fast.run()
+        assert str(fast.current_configuration) == str(plain.current_configuration), rules
+        assert fast.steps == plain.steps
+
+    rle_tape = RLETape(['1', '1', '0'], '0', ['0', '0', '1'], '_')
+    assert (rle_tape.symbols, rle_tape.counts, rle_tape.run, rle_tape.offset) == (['1', '0', '1'], [2, 4, 1], 1, 1)
+    assert str(rle_tape) == '<Tape 110(0)001>'
+    assert str(rle_tape.write('1')) == '<Tape 110(1)001>' and rle_tape.counts == [2, 1, 1, 2, 1]
+    assert str(rle_tape.move_head_left().write('1')) == '<Tape 11(1)1001>' and rle_tape.counts == [4, 2, 1]
+    assert str(rle_tape.write('0')) == '<Tape 11(0)1001>'
+    for _ in range(4):
+        rle_tape.move_head_left()
+    assert str(rle_tape) == '<Tape (_)_1101001>' and rle_tape.counts == [2, 2, 1, 1, 2, 1]
+    assert rle_tape.skip({'_', '1'}, 1) == 4 and str(rle_tape) == '<Tape __11(0)1001>'
+    assert rle_tape.move_head_right().skip({'1', '0'}, 1) == 4 and str(rle_tape) == '<Tape __1101001(_)>'
+    assert rle_tape.skip({'_', '1', '0'}, -1) == 10 and str(rle_tape) == '<Tape (_)__1101001_>'
+
+    loops = DTMRulebook([TMRule(1, 'a', 1, 'a', 'right'), TMRule(1, 'a', 2, 'b', 'left'),
+                         TMRule(1, 'b', 2, 'b', 'right'), TMRule(2, 'c', 2, 'c', 'left')]).self_loops()
+    assert loops == {(1, 'a'): 'right', (2, 'c'): 'left'}
+
+    # macro steps and run-length encoding keep the exact steps and tape of one rule at a time
+    for string in ('aaabbbccc', 'aabbcc', 'aabbc', 'abcabc'):
+        plain = DTM(TMConfiguration(1, Tape([], string[0], list(string[1:]), '_')), [6], test_rulebook)
+        plain.run()
+        for compiled_rulebook, tape_class in ((test_rulebook.compile(), Tape), (test_rulebook, RLETape),
+                                              (test_rulebook.compile(), RLETape)):
+            fast = DTM(TMConfiguration(1, tape_class([], string[0], list(string[1:]), '_')), [6], compiled_rulebook)
+            fast.run()
+            assert str(fast.current_configuration) == str(plain.current_configuration)
+            assert fast.steps == plain.steps
+
+    for _ in range(1000):
+        rules = []
+        for _ in range(random.randrange(1, 10)):
+            state, char = random.randrange(4), random.choice('01_')
+            if random.random() < 0.5:
+                rules.append(TMRule(state, char, state, char, random.choice(['left', 'right'])))
+            else:
+                rules.append(TMRule(state, char, random.randrange(4), random.choice('01_'), random.choice(['left', 'right'])))
+        string = ''.join(random.choice('01') for _ in range(random.randrange(1, 12)))
+        plain = DTM(TMConfiguration(0, Tape([], string[0], list(string[1:]), '_')), [3], DTMRulebook(rules))
+        for _ in range(300):
+            if plain.is_accepting() or plain.is_stuck():
+                break
+            plain.step()
+        else:
+            continue
+        for compiled_rulebook, tape_class in ((DTMRulebook(rules).compile(), Tape), (DTMRulebook(rules), RLETape),
+                                              (DTMRulebook(rules).compile(), RLETape)):
+            fast = DTM(TMConfiguration(0, tape_class([], string[0], list(string[1:]), '_')), [3], compiled_rulebook)
+            fast.run()
+            assert str(fast.current_configuration) == str(plain.current_configuration), rules
+            assert fast.steps == plain.steps
+
+    # more than 256 symbols, the tape is a list and self-loops take one step at a time
+    many = DTMRulebook([TMRule(1, str(number), 1, str(number), 'right') for number in range(300)] +
+                       [TMRule(1, '_', 2, '_', 'left')])
+    dtm = DTM(TMConfiguration(1, Tape([], '0', [str(number) for number in range(1, 300)], '_')), [2], many.compile())
+    dtm.run()
+    assert dtm.is_accepting() and dtm.steps == 301
+
+    # a hundred thousand symbols, about 6.7 billion steps
+    size = 33334
+    dtm = DTM(TMConfiguration(1, RLETape([], 'a', ['a'] * (size - 1) + ['b'] * size + ['c'] * size, '_')),
+              [6], test_rulebook.compile())
+    dtm.run()
+    assert dtm.is_accepting() and dtm.steps > 6 * 10 ** 9
+
+    # budgets stop every engine after exactly the same steps
+    string = 'aaabbbccc'
+    for max_steps in (0, 1, 7, 10, 35, 69, 70, 100):
+        plain = DTM(TMConfiguration(1, Tape([], string[0], list(string[1:]), '_')), [6], test_rulebook)
+        result = plain.run(max_steps=max_steps)
+        assert result.steps == plain.steps == min(max_steps, 70)
+        assert result.outcome == (RunResult.ACCEPTED if max_steps >= 70 else RunResult.BUDGET_EXHAUSTED)
+        for compiled_rulebook, tape_class in ((test_rulebook.compile(), Tape), (test_rulebook.compile(), RLETape)):
+            fast = DTM(TMConfiguration(1, tape_class([], string[0], list(string[1:]), '_')), [6], compiled_rulebook)
+            fast_result = fast.run(max_steps=max_steps)
+            assert str(fast.current_configuration) == str(plain.current_configuration)
+            assert (fast_result.outcome, fast_result.steps, fast_result.budget) == (result.outcome, result.steps, result.budget)
+
+    writer = DTMRulebook([TMRule(1, '_', 1, '1', 'right')])
+    for rulebook_, tape_class in ((writer, Tape), (writer.compile(), Tape), (writer.compile(), RLETape)):
+        dtm = DTM(TMConfiguration(1, tape_class([], '_', [], '_')), [], rulebook_)
+        result = dtm.run(max_tape=100)
+        assert (result.outcome, result.budget, result.steps) == (RunResult.BUDGET_EXHAUSTED, 'tape', 100)
+        assert len(dtm.current_configuration.tape) == 101
+
+    # bouncing between two cells forever
+    bouncer = DTMRulebook([TMRule(1, 'a', 1, 'a', 'right'), TMRule(1, '0', 2, '0', 'right'), TMRule(2, '_', 1, '_', 'left')])
+    for rulebook_, tape_class in ((bouncer, Tape), (bouncer.compile(), Tape), (bouncer.compile(), RLETape)):
+        dtm = DTM(TMConfiguration(1, tape_class([], 'a', ['a'] * 5000 + ['0'], '_')), [], rulebook_)
+        result = dtm.run(max_steps=10 ** 6, detect_cycles=True, cycle_stride=64)
+        assert result.outcome == RunResult.CYCLE_DETECTED and result.steps < 20000
+        dtm = DTM(TMConfiguration(1, tape_class([], 'a', ['a'] * 5000 + ['0'], '_')), [], rulebook_)
+        result = dtm.run(deadline=time.monotonic() + 0.05)
+        assert (result.outcome, result.budget) == (RunResult.BUDGET_EXHAUSTED, 'deadline')
+        assert str(result) == f'<RunResult budget exhausted (deadline), steps={result.steps}>'
+
+    # random machines, halting or not, agree under step and tape budgets
+    for _ in range(500):
+        rules = []
+        for _ in range(random.randrange(1, 10)):
+            state, char = random.randrange(4), random.choice('01_')
+            if random.random() < 0.5:
+                rules.append(TMRule(state, char, state, char, random.choice(['left', 'right'])))
+            else:
+                rules.append(TMRule(state, char, random.randrange(4), random.choice('01_'), random.choice(['left', 'right'])))
+        string = ''.join(random.choice('01') for _ in range(random.randrange(1, 12)))
+        max_steps, max_tape = random.randrange(200), random.choice([None, random.randrange(1, 20)])
+        plain = DTM(TMConfiguration(0, Tape([], string[0], list(string[1:]), '_')), [3], DTMRulebook(rules))
+        result = plain.run(max_steps=max_steps, max_tape=max_tape)
+        for tape_class in (Tape, RLETape):
+            fast = DTM(TMConfiguration(0, tape_class([], string[0], list(string[1:]), '_')), [3], DTMRulebook(rules).compile())
+            fast_result = fast.run(max_steps=max_steps, max_tape=max_tape)
+            assert str(fast.current_configuration) == str(plain.current_configuration), rules
+            assert (fast_result.outcome, fast_result.steps, fast_result.budget) == (result.outcome, result.steps, result.budget)
+
+    dtm = DTM(TMConfiguration(1, Tape([], 'a', list('aabbbccc'), '_')), [6], test_rulebook.compile())
+    result = dtm.run(detect_cycles=True, cycle_stride=1)
+    assert result.outcome == RunResult.ACCEPTED and result.steps == dtm.steps == 70
+    dtm = DTM(TMConfiguration(1, Tape([], 'a', list('aabbcc'), '_')), [6], test_rulebook.compile())
+    assert dtm.run(deadline=time.monotonic() + 60).outcome == RunResult.STUCK
+
+    # snapshots round trip, and a resumed run ends where an uninterrupted one does
+    import tempfile
+
+    tape = Tape(['a', 'X'], (1, 2), ['_', 'b'], '_')
+    state, loaded, steps = decode_snapshot(encode_snapshot(('q', 3), tape, 12345))
+    assert (state, str(loaded), loaded.blank, steps) == (('q', 3), str(tape), '_', 12345)
+    wide = Tape([str(number) for number in range(299)], '299', [], '_')
+    assert str(decode_snapshot(encode_snapshot(1, wide, 0))[1]) == str(wide)
+    assert len(encode_snapshot(1, Tape([], 'a', ['b'] * 9999, '_'), 0)) < 10100
+    garbled = b'(<X>, 1, [])'
+    garbled = SNAPSHOT_MAGIC + SNAPSHOT_HEADER.pack(0, 0, 0, zlib.crc32(garbled), len(garbled), 1) + garbled
+    for data in (b'nonsense', encode_snapshot(1, tape, 0)[:-1], encode_snapshot(1, tape, 0).replace(b'X', b'Y'), garbled):
+        try:
+            decode_snapshot(data)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('expected ValueError')
+
+    string = 'a' * 30 + 'b' * 30 + 'c' * 30
+    whole = DTM(TMConfiguration(1, Tape([], 'a', list(string[1:]), '_')), [6], test_rulebook.compile(macro_steps=False))
+    whole.run()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'abc.snapshot')
+        for background in (True, False):
+            for tape_class in (Tape, ArrayTape, RLETape):
+                dtm = DTM(TMConfiguration(1, tape_class([], 'a', list(string[1:]), '_')), [6], test_rulebook)
+                checkpoint = Checkpointer(path, steps=500, background=background)
+                result = dtm.run(max_steps=2000, checkpoint=checkpoint)
+                assert result.budget == 'steps' and checkpoint.saves == 4
+                assert decode_snapshot(open(path, 'rb').read())[2] == 2000
+                resumed = DTM(TMConfiguration(1, tape_class([], '_', [], '_')), [6], test_rulebook.compile())
+                result = resumed.resume(path, checkpoint=Checkpointer(path, seconds=0.001, background=background))
+                assert result.outcome == RunResult.ACCEPTED and result.steps == whole.steps - 2000
+                assert resumed.steps == whole.steps
+                assert str(resumed.current_configuration) == str(whole.current_configuration)
+                assert isinstance(resumed.current_configuration.tape, tape_class)
+                resumed.load(path)
+                assert resumed.steps == whole.steps and resumed.is_accepting()
+        assert os.listdir(directory) == ['abc.snapshot']
+
+        # the writer thread stops with the run, and a failed write only surfaces when nothing else went wrong
+        threads = threading.active_count()
+        for _ in range(10):
+            dtm = DTM(TMConfiguration(1, Tape([], 'a', list(string[1:]), '_')), [6], test_rulebook)
+            dtm.run(max_steps=100, checkpoint=Checkpointer(path, steps=10))
+        assert threading.active_count() == threads
+        missing = os.path.join(directory, 'missing', 'abc.snapshot')
+        for background in (True, False):
+            dtm = DTM(TMConfiguration(1, Tape([], 'a', list(string[1:]), '_')), [6], test_rulebook)
+            try:
+                dtm.run(max_steps=100, checkpoint=Checkpointer(missing, background=background))
+            except FileNotFoundError:
+                pass
+            else:
+                raise AssertionError('expected FileNotFoundError')
+            dtm = DTM(TMConfiguration(1, Tape([], 'a', list(string[1:]), '_')), [6], test_rulebook)
+            try:
+                dtm.run(deadline='nonsense', checkpoint=Checkpointer(missing, background=background))
+            except TypeError:
+                pass
+            else:
+                raise AssertionError('expected TypeError')
+
+        # a state that reads back as something else is refused when it is saved, not when it is resumed
+        unreadable = DTM(TMConfiguration(float('-inf'), Tape([], 'a', [], '_')), [6], test_rulebook)
+        for save in (lambda: encode_snapshot(object(), tape, 0),
+                     lambda: unreadable.run(checkpoint=Checkpointer(path)),
+                     lambda: unreadable.run(checkpoint=Checkpointer(path, background=False))):
+            try:
+                save()
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('expected ValueError')
+
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
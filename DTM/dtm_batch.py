@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from random import Random
+
+from dtm import Tape, TMConfiguration, TMRule, DTMRulebook, DTM, RunResult, abc_rulebook
+
+# compiled rulebook and accept states of the batch, installed once per worker process
+worker_rulebook = None
+worker_accept_states = None
+
+
+def init_worker(rulebook, accept_states):
+    global worker_rulebook, worker_accept_states
+    worker_rulebook = rulebook
+    worker_accept_states = accept_states
+
+
+def input_tape(string, blank):
+    if not string:
+        return Tape([], blank, [], blank)
+    return Tape([], string[0], list(string[1:]), blank)
+
+
+def run_input(rulebook, accept_states, start_state, string, blank, max_steps, max_tape, timeout):
+    """(input, outcome, steps, final tape) of one run with its own budgets"""
+    dtm = DTM(TMConfiguration(start_state, input_tape(string, blank)), accept_states, rulebook)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    result = dtm.run(max_steps=max_steps, max_tape=max_tape, deadline=deadline)
+    return string, result.outcome, result.steps, result.configuration.tape
+
+
+def run_chunk(chunk, start_state, blank, max_steps, max_tape, timeout):
+    return [run_input(worker_rulebook, worker_accept_states, start_state, string, blank, max_steps, max_tape, timeout)
+            for string in chunk]
+
+
+class BatchRunner:
+    """Runs one rulebook on many inputs in a process pool. The compiled rulebook goes to each worker
+    once, inputs go out in chunks of chunk_size with at most two chunks per worker in flight, and
+    (input, outcome, steps, final tape) comes back as each chunk finishes, not in input order.
+    Every input gets its own max_steps, max_tape and timeout in seconds, so a slow one ends its run
+    as budget exhausted instead of holding up the batch. At least one of the budgets has to be set,
+    max_steps is MAX_STEPS unless given"""
+    MAX_STEPS = 1 << 20
+
+    def __init__(self, rulebook, start_state, accept_states, blank='_', workers=None, chunk_size=64,
+                 max_steps=MAX_STEPS, max_tape=None, timeout=None):
+        if max_steps is None and max_tape is None and timeout is None:
+            raise ValueError('one of max_steps, max_tape or timeout is needed so that every run ends')
+        self.rulebook = rulebook.compile()
+        self.start_state = start_state
+        self.accept_states = accept_states
+        self.blank = blank
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.max_steps = max_steps
+        self.max_tape = max_tape
+        self.timeout = timeout
+
+    def run(self, inputs):
+        inputs = iter(inputs)
+        budgets = (self.start_state, self.blank, self.max_steps, self.max_tape, self.timeout)
+        pool = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self.rulebook, self.accept_states))
+        finished = False
+        try:
+            pending = set()
+            while True:
+                while len(pending) < 2 * self.workers:
+                    chunk = list(islice(inputs, self.chunk_size))
+                    if not chunk:
+                        break
+                    pending.add(pool.submit(run_chunk, chunk, *budgets))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            finished = True
+        finally:
+            # a caller that stops reading early waits neither for the rest of the batch nor for the chunks running
+            pool.shutdown(wait=finished, cancel_futures=True)
+
+    def run_serial(self, inputs):
+        """The same results in input order from a loop in this process"""
+        for string in inputs:
+            yield run_input(self.rulebook, self.accept_states, self.start_state, string, self.blank,
+                            self.max_steps, self.max_tape, self.timeout)
+
+
+def benchmark(counts=(1000, 10000), workers=None):
+    random = Random(0)
+    rulebook = abc_rulebook()
+    print(f'{"inputs":>7} {"dtm loop s":>11} {"compiled loop s":>16} {"pool s":>7}')
+    for count in counts:
+        inputs = []
+        for _ in range(count):
+            size = random.randrange(1, 20)
+            string = 'a' * size + 'b' * size + 'c' * size
+            inputs.append(string if random.random() < 0.5 else ''.join(random.sample(string, len(string))))
+
+        start = time.perf_counter()
+        loop = []
+        for string in inputs:
+            dtm = DTM(TMConfiguration(1, input_tape(string, '_')), [6], rulebook)
+            result = dtm.run(max_steps=10000)
+            loop.append((string, result.outcome, result.steps))
+        loop_time = time.perf_counter() - start
+
+        runner = BatchRunner(rulebook, 1, [6], workers=workers, max_steps=10000)
+        start = time.perf_counter()
+        compiled = [result[:3] for result in runner.run_serial(inputs)]
+        compiled_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pooled = [result[:3] for result in runner.run(inputs)]
+        pool_time = time.perf_counter() - start
+
+        assert loop == compiled and sorted(loop) == sorted(pooled)
+        print(f'{count:>7} {loop_time:>11.4f} {compiled_time:>16.4f} {pool_time:>7.4f}')
+
+
+if __name__ == "__main__":
+    print('-' * 20)
+    rulebook = abc_rulebook()
+    inputs = ['aaabbbccc', 'aabbcc', '', 'aabbc', 'abcabc', 'a' * 50 + 'b' * 50 + 'c' * 50] * 5
+    runner = BatchRunner(rulebook, 1, [6], workers=2, chunk_size=4, max_steps=5000)
+    serial = list(runner.run_serial(inputs))
+    pooled = list(runner.run(inputs))
+    assert len(pooled) == len(inputs)
+    assert sorted((string, outcome, steps, str(tape)) for string, outcome, steps, tape in pooled) == \
+        sorted((string, outcome, steps, str(tape)) for string, outcome, steps, tape in serial)
+    outcomes = dict((string, (outcome, steps)) for string, outcome, steps, _ in serial)
+    assert outcomes['aaabbbccc'] == (RunResult.ACCEPTED, 70)
+    assert outcomes[''] == (RunResult.ACCEPTED, 1)
+    assert outcomes['aabbc'][0] == RunResult.STUCK
+    assert outcomes['a' * 50 + 'b' * 50 + 'c' * 50] == (RunResult.BUDGET_EXHAUSTED, 5000)
+
+    print('-' * 20)
+    # a machine that never halts only costs its own budget
+    endless = DTMRulebook([TMRule(1, '_', 1, '1', 'right'), TMRule(1, 'a', 2, 'a', 'right'), TMRule(2, '_', 3, '_', 'left')])
+    runner = BatchRunner(endless, 1, [3], workers=2, chunk_size=1, max_tape=1000, timeout=1)
+    results = dict((string, (outcome, steps)) for string, outcome, steps, _ in runner.run(['a', '_', 'a']))
+    assert results == {'a': (RunResult.ACCEPTED, 2), '_': (RunResult.BUDGET_EXHAUSTED, 1000)}
+
+    print('-' * 20)
+    # stopping early leaves the rest of the batch
+    runner = BatchRunner(rulebook, 1, [6], workers=2, chunk_size=2)
+    results = runner.run('aabbcc' for _ in range(1000))
+    assert next(results)[1] == RunResult.ACCEPTED
+    results.close()
+    try:
+        BatchRunner(endless, 1, [3], max_steps=None)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('expected ValueError')
+
+    print('-' * 20)
+    # closing early does not wait for a chunk that is still running
+    slow = DTMRulebook([TMRule(1, '_', 1, '_', 'right')])
+    runner = BatchRunner(slow, 1, [2], workers=1, chunk_size=1, max_steps=None, timeout=5)
+    results = runner.run(['a', '_'])
+    assert next(results)[1] == RunResult.STUCK
+    started = time.monotonic()
+    results.close()
+    # waiting would take until the running chunk's own timeout
+    assert time.monotonic() - started < 5
+
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
@@ -0,0 +1,385 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
+
+from dtm import Tape, TMConfiguration, TMRule, RunResult
+
+
+class TapeStack:
+    """One side of an NTMTape, a chain of cons cells with the cell nearest the head on top. Each cell
+    keeps the size and hash of the chain below it, and tails are shared between tapes, so equal
+    halves from the same parent are usually the same object and the walk in __eq__ stops early"""
+    __slots__ = ('head', 'tail', 'size', 'hash_')
+
+    @staticmethod
+    def cons(head, tail, size, hash_):
+        stack = object.__new__(TapeStack)
+        stack.head, stack.tail, stack.size, stack.hash_ = head, tail, size, hash_
+        return stack
+
+    @property
+    def stk(self):
+        res = []
+        stack = self
+        while stack.size:
+            res.append(stack.head)
+            stack = stack.tail
+        return res
+
+    def __eq__(self, other):
+        a, b = self, other
+        while a is not b:
+            if a.size != b.size or a.hash_ != b.hash_ or a.head != b.head:
+                return False
+            if not a.size:
+                return True
+            a, b = a.tail, b.tail
+        return True
+
+    def __hash__(self):
+        return self.hash_
+
+    def pop(self):
+        return self.tail if self.size else self
+
+    def push(self, character):
+        return TapeStack.cons(character, self, self.size + 1, hash((character, self.hash_)))
+
+
+TapeStack.EMPTY = TapeStack.cons(None, None, 0, hash(()))
+
+
+class NTMTape:
+    """Persistent tape for branching runs. The cells left and right of the head are TapeStacks with
+    no blanks at the far ends, so a move or write makes at most one new cell, sibling configurations
+    share every cell they have in common, and equal tapes hash alike in O(1)"""
+    __slots__ = ('left', 'middle', 'right', 'blank', 'hash_')
+
+    def __new__(cls, left, middle, right, blank):
+        # left and right as in Tape: lists with left[-1] and right[0] next to the head
+        left_stack = right_stack = TapeStack.EMPTY
+        for char in left:
+            left_stack = NTMTape.push(left_stack, char, blank)
+        for char in reversed(right):
+            right_stack = NTMTape.push(right_stack, char, blank)
+        return NTMTape.make(left_stack, middle, right_stack, blank)
+
+    @staticmethod
+    def make(left, middle, right, blank):
+        tape = object.__new__(NTMTape)
+        tape.left, tape.middle, tape.right, tape.blank = left, middle, right, blank
+        tape.hash_ = hash((left.hash_, middle, right.hash_))
+        return tape
+
+    @staticmethod
+    def push(stack, char, blank):
+        if not stack.size and char == blank:
+            return stack
+        return stack.push(char)
+
+    @staticmethod
+    def from_tape(tape):
+        return NTMTape(tape.left, tape.middle, tape.right, tape.blank)
+
+    def to_tape(self):
+        return Tape(self.left.stk[::-1], self.middle, self.right.stk, self.blank)
+
+    def __reduce__(self):
+        return NTMTape, (self.left.stk[::-1], self.middle, self.right.stk, self.blank)
+
+    def __eq__(self, other):
+        return (self.hash_ == other.hash_ and self.middle == other.middle and
+                self.left == other.left and self.right == other.right)
+
+    def __hash__(self):
+        return self.hash_
+
+    def __len__(self):
+        return self.left.size + 1 + self.right.size
+
+    def __str__(self):
+        return str(self.to_tape())
+
+    def write(self, character):
+        return NTMTape.make(self.left, character, self.right, self.blank)
+
+    def move_head_left(self):
+        middle = self.left.head if self.left.size else self.blank
+        return NTMTape.make(self.left.pop(), middle, NTMTape.push(self.right, self.middle, self.blank), self.blank)
+
+    def move_head_right(self):
+        middle = self.right.head if self.right.size else self.blank
+        return NTMTape.make(NTMTape.push(self.left, self.middle, self.blank), middle, self.right.pop(), self.blank)
+
+
+class NTMRulebook:
+    """Any number of rules for each (state, character), all of them are followed"""
+    def __init__(self, rules):
+        self.rules = rules
+        self.index = {}
+        for rule in rules:
+            self.index.setdefault((rule.state, rule.character), []).append(rule)
+
+    def rules_for(self, configuration):
+        return self.index.get((configuration.state, configuration.tape.middle), [])
+
+    def next_configurations(self, configuration):
+        return [rule.follow(configuration) for rule in self.rules_for(configuration)]
+
+
+class Frontier:
+    """One level of the breadth-first search: a list in memory, and batches of max_size configurations
+    pickled to a temporary file in directory once the list is full"""
+    def __init__(self, max_size, directory=None):
+        self.max_size = max_size
+        self.directory = directory
+        self.configurations = []
+        self.file = None
+        self.spilled = 0
+
+    def __len__(self):
+        return len(self.configurations) + self.spilled
+
+    def append(self, configuration):
+        self.configurations.append(configuration)
+        if len(self.configurations) >= self.max_size and self.directory is not None:
+            if self.file is None:
+                self.file = tempfile.TemporaryFile(dir=self.directory)
+            pickle.dump(self.configurations, self.file, pickle.HIGHEST_PROTOCOL)
+            self.spilled += len(self.configurations)
+            self.configurations = []
+
+    def is_full(self):
+        return len(self.configurations) >= self.max_size
+
+    def __iter__(self):
+        yield from self.configurations
+        if self.file is not None:
+            # closed too when the search stops partway through the level
+            try:
+                self.file.seek(0)
+                for _ in range(self.spilled // self.max_size):
+                    yield from pickle.load(self.file)
+            finally:
+                self.file.close()
+
+
+class SeenSet:
+    """Every (state, tape) key met by the search. Up to max_size keys are held in memory, once that
+    many have come in they move to an SQLite table in directory as 16-byte digests of their repr, so
+    the set stays complete however large it grows"""
+    def __init__(self, max_size, directory=None):
+        self.max_size = max_size
+        self.directory = directory
+        self.keys = set()
+        self.database = None
+        self.path = None
+        self.spilled = 0
+
+    def __len__(self):
+        return len(self.keys) + self.spilled
+
+    @staticmethod
+    def digest(key):
+        state, tape = key
+        encoding = repr((state, tape.left.stk, tape.middle, tape.right.stk)).encode()
+        return hashlib.blake2b(encoding, digest_size=16).digest()
+
+    def __contains__(self, key):
+        if key in self.keys:
+            return True
+        if self.database is None:
+            return False
+        return self.database.execute('SELECT 1 FROM seen WHERE digest = ?', (self.digest(key),)).fetchone() is not None
+
+    def add(self, key):
+        self.keys.add(key)
+
+    def is_full(self):
+        return len(self.keys) >= self.max_size
+
+    def spill(self):
+        if self.database is None:
+            handle, self.path = tempfile.mkstemp(suffix='.sqlite', dir=self.directory)
+            os.close(handle)
+            self.database = sqlite3.connect(self.path)
+            self.database.execute('CREATE TABLE seen (digest BLOB PRIMARY KEY) WITHOUT ROWID')
+        with self.database:
+            self.database.executemany('INSERT OR IGNORE INTO seen VALUES (?)', ((self.digest(key),) for key in self.keys))
+        self.spilled += len(self.keys)
+        self.keys = set()
+
+    def close(self):
+        if self.database is not None:
+            self.database.close()
+            os.remove(self.path)
+            self.database = None
+
+
+class NTM:
+    """Breadth-first search over the configurations of a nondeterministic Turing machine, so the
+    first accepting configuration found is one at the fewest steps. Configurations seen before are
+    dropped, keyed on (state, tape) whose hash comes from the tape's stacks. At most
+    max_configurations are kept in memory between the seen set and the next level: past that,
+    with a spill_directory both go to disk, the next level in batches and the seen set as digests,
+    without one the run ends as budget exhausted ('memory')"""
+    MAX_CONFIGURATIONS = 1 << 20
+    DEADLINE_CHECK = 1024
+
+    def __init__(self, start_configuration, accept_states, rulebook, max_configurations=MAX_CONFIGURATIONS,
+                 spill_directory=None):
+        self.start_configuration = start_configuration
+        self.accept_states = accept_states
+        self.rulebook = rulebook
+        self.max_configurations = max_configurations
+        self.spill_directory = spill_directory
+        self.expanded = 0
+        self.seen_spills = 0
+        self.spilled = 0
+
+    def run(self, max_steps=None, deadline=None):
+        """ACCEPTED with the accepting configuration, STUCK when every branch halts or repeats without
+        accepting, or BUDGET_EXHAUSTED past max_steps levels, deadline or the memory cap"""
+        start = self.start_configuration
+        if start.state in self.accept_states:
+            return RunResult(RunResult.ACCEPTED, 0, start)
+        half = max(1, self.max_configurations // 2)
+        seen = SeenSet(half, self.spill_directory)
+        seen.add((start.state, start.tape))
+        level = [start]
+        depth = 0
+        try:
+            while len(level):
+                if max_steps is not None and depth >= max_steps:
+                    return RunResult(RunResult.BUDGET_EXHAUSTED, depth, None, 'steps')
+                next_level = Frontier(half, self.spill_directory)
+                for configuration in level:
+                    self.expanded += 1
+                    if deadline is not None and not self.expanded % self.DEADLINE_CHECK and time.monotonic() >= deadline:
+                        return RunResult(RunResult.BUDGET_EXHAUSTED, depth, None, 'deadline')
+                    for next_configuration in self.rulebook.next_configurations(configuration):
+                        key = (next_configuration.state, next_configuration.tape)
+                        if key in seen:
+                            continue
+                        if next_configuration.state in self.accept_states:
+                            return RunResult(RunResult.ACCEPTED, depth + 1, next_configuration)
+                        if seen.is_full() or next_level.is_full():
+                            if self.spill_directory is None:
+                                return RunResult(RunResult.BUDGET_EXHAUSTED, depth, None, 'memory')
+                            if seen.is_full():
+                                seen.spill()
+                                self.seen_spills += 1
+                        seen.add(key)
+                        next_level.append(next_configuration)
+                self.spilled += next_level.spilled
+                level = next_level
+                depth += 1
+            return RunResult(RunResult.STUCK, depth, None)
+        finally:
+            seen.close()
+
+
+class NTMDesign:
+    def __init__(self, start_state, blank, accept_states, rulebook):
+        self.start_state = start_state
+        self.blank = blank
+        self.accept_states = accept_states
+        self.rulebook = rulebook
+
+    def to_ntm(self, string, **options):
+        tape = NTMTape([], string[0] if string else self.blank, list(string[1:]), self.blank)
+        return NTM(TMConfiguration(self.start_state, tape), self.accept_states, self.rulebook, **options)
+
+    def is_accepts(self, string, **options):
+        return self.to_ntm(string, **options).run().outcome == RunResult.ACCEPTED
+
+
+if __name__ == "__main__":
+    from dtm import DTM, abc_rulebook
+
+    print('-' * 20)
+    tape = NTMTape(['1', '0'], '1', ['_', '1'], '_')
+    assert str(tape) == '<Tape 10(1)_1>'
+    assert str(tape.move_head_left().move_head_left().move_head_left()) == '<Tape (_)101_1>'
+    assert str(tape.move_head_right().move_head_right().move_head_right()) == '<Tape 101_1(_)>'
+    assert str(tape.write('0').move_head_right()) == '<Tape 100(_)1>'
+    # trailing blanks are dropped, so tapes that only differ in blanks at the far ends are equal
+    assert tape.move_head_left().move_head_right() == tape and hash(tape.move_head_left().move_head_right()) == hash(tape)
+    assert NTMTape([], '_', [], '_').move_head_right().move_head_right() == NTMTape(['_', '_'], '_', ['_'], '_')
+    assert tape != tape.write('0') and tape != tape.move_head_right()
+    # siblings share the cells they did not change
+    assert tape.write('0').move_head_left().right.tail is tape.write('1').move_head_left().right.tail
+    assert pickle.loads(pickle.dumps(tape)) == tape
+
+    print('-' * 20)
+    # strings of a's and b's with abb somewhere, the machine guesses where it starts
+    rulebook = NTMRulebook([
+        TMRule(1, 'a', 1, 'a', 'right'), TMRule(1, 'b', 1, 'b', 'right'),
+        TMRule(1, 'a', 2, 'a', 'right'),
+        TMRule(2, 'b', 3, 'b', 'right'),
+        TMRule(3, 'b', 4, 'b', 'right'),
+    ])
+    design = NTMDesign(1, '_', [4], rulebook)
+    assert design.is_accepts('babbab')
+    assert design.is_accepts('aabb')
+    assert not design.is_accepts('ababab')
+    assert not design.is_accepts('')
+    result = design.to_ntm('bbbabbaaa').run()
+    assert result.outcome == RunResult.ACCEPTED and result.steps == 6
+    assert str(result.configuration) == '<TMConfiguration state=4, tape=<Tape bbbabb(a)aa>>'
+
+    print('-' * 20)
+    # a deterministic rulebook finds the same run as the DTM
+    abc = NTMDesign(1, '_', [6], NTMRulebook(abc_rulebook().rules))
+    for string in ('aaabbbccc', 'aabbc'):
+        dtm = DTM(TMConfiguration(1, Tape([], string[0], list(string[1:]), '_')), [6], abc_rulebook())
+        dtm_result = dtm.run()
+        result = abc.to_ntm(string).run()
+        assert result.outcome == dtm_result.outcome
+        if result.outcome == RunResult.ACCEPTED:
+            assert result.steps == dtm_result.steps
+
+    print('-' * 20)
+    # writing 0 or 1 back and forth between two cells branches forever, but only into a few configurations
+    bouncing = NTMRulebook([TMRule(1, char, 2, bit, 'right') for char in '01_' for bit in '01'] +
+                           [TMRule(2, char, 1, char, 'left') for char in '01_'])
+    ntm = NTM(TMConfiguration(1, NTMTape([], '_', [], '_')), [3], bouncing)
+    result = ntm.run()
+    assert result.outcome == RunResult.STUCK and ntm.expanded < 20
+
+    print('-' * 20)
+    # a bit is guessed over each of ten a's, and only the guess of all ones is accepted when read back,
+    # so the search holds 1024 distinct configurations at the widest level
+    guessing = NTMRulebook([TMRule(1, 'a', 1, bit, 'right') for bit in '01'] + [TMRule(1, '_', 2, '_', 'left'),
+                           TMRule(2, '1', 2, '1', 'left'), TMRule(2, '_', 3, '_', 'right')])
+    guessing_design = NTMDesign(1, '_', [3], guessing)
+    ntm = guessing_design.to_ntm('a' * 10)
+    result = ntm.run()
+    assert result.outcome == RunResult.ACCEPTED and result.steps == 22
+    assert str(result.configuration) == '<TMConfiguration state=3, tape=<Tape (1)111111111>>'
+    assert ntm.spilled == ntm.seen_spills == 0
+    result = guessing_design.to_ntm('a' * 10, max_configurations=1000).run()
+    assert (result.outcome, result.budget) == (RunResult.BUDGET_EXHAUSTED, 'memory')
+    assert guessing_design.to_ntm('a' * 10).run(max_steps=21).budget == 'steps'
+    with tempfile.TemporaryDirectory() as directory:
+        ntm = guessing_design.to_ntm('a' * 10, max_configurations=100, spill_directory=directory)
+        result = ntm.run()
+        assert result.outcome == RunResult.ACCEPTED and result.steps == 22
+        assert ntm.spilled > 0 and ntm.seen_spills > 0
+        assert not guessing_design.is_accepts('a' * 6 + 'b', max_configurations=100, spill_directory=directory)
+        assert os.listdir(directory) == []
+
+        # guessing bits while bouncing between the ends of six cells never accepts, and the seen set
+        # on disk still lets the search run out of new configurations
+        bouncing = NTMDesign(1, '_', [3], NTMRulebook(
+            [TMRule(1, char, 1, bit, 'right') for char in 'a01' for bit in '01'] + [TMRule(1, '_', 2, '_', 'left')] +
+            [TMRule(2, char, 2, bit, 'left') for char in '01' for bit in '01'] + [TMRule(2, '_', 1, '_', 'right')]))
+        whole = bouncing.to_ntm('a' * 6).run()
+        assert whole.outcome == RunResult.STUCK
+        ntm = bouncing.to_ntm('a' * 6, max_configurations=200, spill_directory=directory)
+        result = ntm.run(max_steps=5000)
+        assert (result.outcome, result.steps) == (RunResult.STUCK, whole.steps)
+        assert ntm.seen_spills > 0 and os.listdir(directory) == []
@@ -0,0 +1,196 @@
+import sys
+import time
+from random import Random
+
+from NFA.nfa_epsilon import FARule, NFARulebook, NFADesign
+
+
+class MultiPatternMatcher:
+    """Many designs merged into one automaton. States of design i are tagged (i, state), and
+    each DFA state built from them on demand carries the set of pattern ids it accepts"""
+    MAX_STATES = 4096
+
+    def __init__(self, designs, max_states=MAX_STATES):
+        self.designs = designs
+        self.max_states = max_states
+        rules = []
+        for pattern_id, design in enumerate(designs):
+            for rule in design.rulebook.rules:
+                rules.append(FARule((pattern_id, rule.state), rule.character, (pattern_id, rule.next_state)))
+        self.rulebook = NFARulebook(rules)
+        self.moves = {}
+        for rule in rules:
+            if rule.character is not None:
+                self.moves.setdefault((rule.state, rule.character), set()).add(rule.next_state)
+        self.start_states = frozenset(self.rulebook.follow_free_moves(
+            set((pattern_id, design.start_state) for pattern_id, design in enumerate(designs))))
+        self.flush()
+
+    def flush(self):
+        self.transitions = {}
+        self.accepted = {}
+
+    def pattern_ids(self, states):
+        ids = self.accepted.get(states)
+        if ids is None:
+            ids = self.accepted[states] = frozenset(
+                pattern_id for pattern_id, state in states if state in self.designs[pattern_id].accept_states)
+        return ids
+
+    def next_states(self, states, char, unanchored=False):
+        key = (states, char, unanchored)
+        next_states = self.transitions.get(key)
+        if next_states is None:
+            if len(self.transitions) >= self.max_states:
+                self.flush()
+            moved = set()
+            for state in states:
+                moved |= self.moves.get((state, char), set())
+            next_states = self.rulebook.follow_free_moves(moved)
+            if unanchored:
+                # a new match may start at every position, so the start states are always added back
+                next_states |= self.start_states
+            next_states = self.transitions[key] = frozenset(next_states)
+        return next_states
+
+    def matching_ids(self, string):
+        """Ids of every design that accepts the whole string"""
+        states = self.start_states
+        for char in string:
+            states = self.next_states(states, char)
+            if not states:
+                break
+        return self.pattern_ids(states)
+
+    def find_all(self, string):
+        """(end, pattern ids) for every position where at least one pattern's match ends"""
+        states = self.start_states
+        position = 0
+        for char in string:
+            ids = self.pattern_ids(states)
+            if ids:
+                yield position, ids
+            states = self.next_states(states, char, unanchored=True)
+            position += 1
+        ids = self.pattern_ids(states)
+        if ids:
+            yield position, ids
+
+
+class AhoCorasick:
+    """Trie of literal strings with failure links, one pass reports every literal ending at each position"""
+    def __init__(self, literals):
+        self.literals = literals
+        self.goto = [{}]
+        self.outputs = [set()]
+        for pattern_id, literal in enumerate(literals):
+            node = 0
+            for char in literal:
+                if char not in self.goto[node]:
+                    self.goto[node][char] = len(self.goto)
+                    self.goto.append({})
+                    self.outputs.append(set())
+                node = self.goto[node][char]
+            self.outputs[node].add(pattern_id)
+        # breadth-first, so the failure link of every shorter suffix is ready before it is needed
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child] |= self.outputs[self.fail[child]]
+                queue.append(child)
+        self.outputs = [frozenset(output) for output in self.outputs]
+        self.ids = {}
+        for pattern_id, literal in enumerate(literals):
+            self.ids.setdefault(literal, set()).add(pattern_id)
+
+    def matching_ids(self, string):
+        return frozenset(self.ids.get(string, ()))
+
+    def find_all(self, string):
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        node = 0
+        if outputs[0]:
+            yield 0, outputs[0]
+        position = 0
+        for char in string:
+            position += 1
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if outputs[node]:
+                yield position, outputs[node]
+
+
+def literal_design(literal):
+    rules = [FARule(index, char, index + 1) for index, char in enumerate(literal)]
+    return NFADesign(0, [len(literal)], NFARulebook(rules))
+
+
+def multi_pattern(patterns):
+    """Aho-Corasick when every pattern is a literal string, otherwise one merged automaton.
+    Literal strings mixed with designs are turned into designs of their own"""
+    if all(isinstance(pattern, str) for pattern in patterns):
+        return AhoCorasick(patterns)
+    return MultiPatternMatcher([literal_design(pattern) if isinstance(pattern, str) else pattern
+                                for pattern in patterns])
+
+
+def benchmark(pattern_counts=(10, 50, 200), text_length=20000):
+    from NFA.pattern import compile_pattern
+
+    random = Random(0)
+    text = ''.join(random.choice('abcd') for _ in range(text_length))
+    print(f'{"patterns":>8} {"per pass s":>11} {"merged s":>9} {"aho-corasick s":>15}')
+    for pattern_count in pattern_counts:
+        literals = list(set(''.join(random.choice('abcd') for _ in range(8)) for _ in range(pattern_count)))
+        designs = [compile_pattern(literal) for literal in literals]
+
+        start = time.perf_counter()
+        per_pass = set()
+        for pattern_id, design in enumerate(designs):
+            per_pass |= set((end, pattern_id) for _, end in design.find_all(text))
+        per_pass_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        merged = set((end, pattern_id) for end, ids in MultiPatternMatcher(designs).find_all(text) for pattern_id in ids)
+        merged_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        aho = set((end, pattern_id) for end, ids in multi_pattern(literals).find_all(text) for pattern_id in ids)
+        aho_time = time.perf_counter() - start
+
+        assert per_pass == merged == aho
+        print(f'{len(literals):>8} {per_pass_time:>11.4f} {merged_time:>9.4f} {aho_time:>15.4f}')
+
+
+if __name__ == "__main__":
+    from NFA.pattern import compile_pattern
+
+    print('-' * 20)
+    matcher = multi_pattern([compile_pattern('ab+'), compile_pattern('(a|b)*abb'), 'ba', compile_pattern('b*')])
+    assert matcher.matching_ids('abb') == {0, 1}
+    assert matcher.matching_ids('ba') == {2}
+    assert matcher.matching_ids('') == {3}
+    assert matcher.matching_ids('c') == set()
+    assert list(matcher.find_all('cbab')) == [(0, {3}), (1, {3}), (2, {3}), (3, {2, 3}), (4, {0, 3})]
+
+    print('-' * 20)
+    aho_corasick = multi_pattern(['he', 'she', 'his', 'hers'])
+    assert isinstance(aho_corasick, AhoCorasick)
+    assert list(aho_corasick.find_all('ushers')) == [(4, {0, 1}), (6, {3})]
+    assert list(aho_corasick.find_all('ahishe')) == [(4, {2}), (6, {0, 1})]
+    assert aho_corasick.matching_ids('his') == {2}
+    assert list(multi_pattern(['aa', 'a']).find_all('aaa')) == [(1, {1}), (2, {0, 1}), (3, {0, 1})]
+
+    print('-' * 20)
+    literals = ['he', 'she', 'his', 'hers']
+    merged = MultiPatternMatcher([literal_design(literal) for literal in literals])
+    assert list(merged.find_all('ushers')) == list(aho_corasick.find_all('ushers'))
+
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
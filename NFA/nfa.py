@@ -1,3 +1,6 @@
+from DFA.dfa import FARule as DFARule, DFARulebook, DFADesign, alphabet_classes, match_spans
+
+
 class FARule:
     def __init__(self, state, character, next_state):
         self.state = state
@@ -24,6 +27,11 @@ class NFARulebook:
             for state in self.follow_rules_for(state, character):
                 res.add(state)
         return res
+
+    def next_states_for_string(self, states, string):
+        for char in string:
+            states = self.next_states(states, char)
+        return states
         
     def follow_rules_for(self, state, character):
         res = []
@@ -38,6 +46,86 @@ class NFARulebook:
                 res.append(rule)
         return res
 
+    def character_classes(self):
+        """Character to class id, characters with the same moves from every state share a class"""
+        moves = {}
+        for rule in self.rules:
+            moves.setdefault(rule.character, set()).add((rule.state, rule.next_state))
+        character_classes, _ = alphabet_classes({character: frozenset(move) for character, move in moves.items()})
+        return character_classes
+
+    def moves(self):
+        """(state, character) to the list of next states, in rule order"""
+        moves = {}
+        for rule in self.rules:
+            moves.setdefault((rule.state, rule.character), []).append(rule.next_state)
+        return moves
+
+    def compile(self):
+        return CompiledNFARulebook(self.rules)
+
+
+class CompiledNFARulebook:
+    """Numbered states with sets of states as int bitmasks. One successor mask is precomputed per
+    state and character class, so a step ORs the masks of the states that are set"""
+    def __init__(self, rules):
+        self.rules = rules
+        self.states = []
+        self.state_ids = {}
+        for rule in rules:
+            for state in (rule.state, rule.next_state):
+                if state not in self.state_ids:
+                    self.state_ids[state] = len(self.states)
+                    self.states.append(state)
+        self.character_classes = NFARulebook(rules).character_classes()
+        class_count = len(set(self.character_classes.values()))
+        # successors[class][state id] is the mask of the states that state moves to on that class
+        self.successors = [[0] * len(self.states) for _ in range(class_count)]
+        for rule in rules:
+            self.successors[self.character_classes[rule.character]][self.state_ids[rule.state]] |= \
+                1 << self.state_ids[rule.next_state]
+
+    def mask_for(self, states):
+        mask = 0
+        for state in states:
+            if state in self.state_ids:
+                mask |= 1 << self.state_ids[state]
+        return mask
+
+    def states_for(self, mask):
+        return set(state for state_id, state in enumerate(self.states) if mask >> state_id & 1)
+
+    def next_mask(self, mask, character):
+        character_class = self.character_classes.get(character)
+        if character_class is None:
+            return 0
+        successors = self.successors[character_class]
+        next_mask = 0
+        while mask:
+            low = mask & -mask
+            next_mask |= successors[low.bit_length() - 1]
+            mask ^= low
+        return next_mask
+
+    def next_mask_for_string(self, mask, string):
+        for char in string:
+            if not mask:
+                break
+            mask = self.next_mask(mask, char)
+        return mask
+
+    def next_states(self, states, character):
+        return self.states_for(self.next_mask(self.mask_for(states), character))
+
+    def next_states_for_string(self, states, string):
+        if not string:
+            # states that appear in no rule cannot be numbered, but they survive an empty string
+            return set(states)
+        return self.states_for(self.next_mask_for_string(self.mask_for(states), string))
+
+    def compile(self):
+        return self
+
 
 class NFA:
     def __init__(self, current_states, accept_states, rulebook):
@@ -50,15 +138,61 @@ class NFA:
         return len(intersect) > 0
 
     def read_character(self, character):
-        self.current_states = rulebook.next_states(self.current_states, character)
+        self.current_states = self.rulebook.next_states(self.current_states, character)
         return self.current_states
     
     def read_string(self, string):
-        for char in string:
-            self.read_character(char)
+        self.current_states = self.rulebook.next_states_for_string(self.current_states, string)
         return self.current_states
 
 
+class LazyDFA:
+    """Builds DFA states on demand while matching and keeps them in a bounded cache.
+    The whole cache is flushed when it fills up, and a match that keeps flushing it
+    falls back to plain NFA simulation for the rest of its input"""
+    MAX_STATES = 4096
+    MAX_FLUSHES = 8
+
+    def __init__(self, nfa_design, max_states=MAX_STATES, max_flushes=MAX_FLUSHES):
+        self.nfa_design = nfa_design
+        self.max_states = max_states
+        self.max_flushes = max_flushes
+        self.moves = NFARulebook(nfa_design.rulebook.rules).moves()
+        self.flushes = 0
+        self.fallbacks = 0
+        self.flush()
+
+    def flush(self):
+        # every cached DFA state maps characters to the next cached DFA state
+        self.transitions = {}
+
+    def next_states(self, states, character):
+        return frozenset(next_state for state in states for next_state in self.moves.get((state, character), []))
+
+    def is_accepts(self, string):
+        states = frozenset([self.nfa_design.start_state])
+        flushes = 0
+        for index, char in enumerate(string):
+            row = self.transitions.get(states)
+            if row is None:
+                if len(self.transitions) >= self.max_states:
+                    self.flush()
+                    self.flushes += 1
+                    flushes += 1
+                    if flushes > self.max_flushes:
+                        # the cache is thrashing, simulate the NFA directly from here
+                        self.fallbacks += 1
+                        nfa = NFA(set(states), self.nfa_design.accept_states, self.nfa_design.rulebook)
+                        nfa.read_string(string[index:])
+                        return nfa.accepting()
+                row = self.transitions[states] = {}
+            next_states = row.get(char)
+            if next_states is None:
+                next_states = row[char] = self.next_states(states, char)
+            states = next_states
+        return any(state in self.nfa_design.accept_states for state in states)
+
+
 class NFADesign:
     def __init__(self, start_state, accept_states, rulebook):
         self.start_state = start_state
@@ -73,8 +207,51 @@ class NFADesign:
         nfa.read_string(string)
         return nfa.accepting()
 
+    def compiled(self):
+        return NFADesign(self.start_state, self.accept_states, self.rulebook.compile())
+
+    def to_dfa_design(self):
+        """Subset construction, every DFA state is a frozenset of NFA states"""
+        rulebook = NFARulebook(self.rulebook.rules)
+        moves = rulebook.moves()
+        # characters in the same class move every subset the same way, so each class is followed once
+        classes = {}
+        for character, character_class in rulebook.character_classes().items():
+            classes.setdefault(character_class, []).append(character)
+        start_state = frozenset([self.start_state])
+        subsets = [start_state]
+        seen = {start_state}
+        rules = []
+        for states in subsets:
+            for characters in classes.values():
+                next_states = frozenset(next_state for state in states
+                                        for next_state in moves.get((state, characters[0]), []))
+                if not next_states:
+                    continue
+                rules.extend(DFARule(states, character, next_states) for character in characters)
+                if next_states not in seen:
+                    seen.add(next_states)
+                    subsets.append(next_states)
+        accept_states = [states for states in subsets if any(state in self.accept_states for state in states)]
+        return DFADesign(start_state, accept_states, DFARulebook(rules))
+
+    def find_all(self, string):
+        moves = NFARulebook(self.rulebook.rules).moves()
+        return match_spans([self.start_state], lambda state, char: moves.get((state, char), []),
+                           lambda state: state in self.accept_states, string)
+
+    def search(self, string):
+        return next(self.find_all(string), None)
+
+    def to_lazy_dfa(self, max_states=LazyDFA.MAX_STATES, max_flushes=LazyDFA.MAX_FLUSHES):
+        return LazyDFA(self, max_states, max_flushes)
+
 
 if __name__ == "__main__":
+    from random import Random
+
+    from DFA.dfa import class_ranges
+
     print('-' * 20)
     rulebook = NFARulebook([
         FARule(1, 'a', 1), FARule(1, 'b', 1), FARule(1, 'b', 2),
@@ -107,3 +284,58 @@ if __name__ == "__main__":
     print(nfa_design.is_accepts('bab'))    # True
     print(nfa_design.is_accepts('bbbbb'))  # True
     print(nfa_design.is_accepts('bbabb'))  # False
+
+    print('-' * 20)
+    character_classes = rulebook.character_classes()
+    assert character_classes['a'] != character_classes['b']
+    vowels_rulebook = NFARulebook(
+        [FARule(1, char, 1) for char in 'abcdefghijklmnopqrstuvwxyz'] +
+        [FARule(1, vowel, 2) for vowel in 'aeiou']
+    )
+    character_classes = vowels_rulebook.character_classes()
+    assert len(set(character_classes.values())) == 2
+    assert character_classes['a'] == character_classes['u']
+    assert character_classes['b'] == character_classes['z']
+    assert class_ranges(character_classes, 2)[0][:3] == [0, ord('a'), ord('b')]
+
+    print('-' * 20)
+    dfa_design = nfa_design.to_dfa_design()
+    lazy_dfa = nfa_design.to_lazy_dfa()
+    for string in ['', 'a', 'b', 'bab', 'bbbbb', 'bbabb', 'abbaab', 'babbbab']:
+        assert dfa_design.is_accepts(string) == nfa_design.is_accepts(string)
+        assert lazy_dfa.is_accepts(string) == nfa_design.is_accepts(string)
+    assert dfa_design.state_count() == 8
+    assert dfa_design.minimize()[0].state_count() == 8
+
+    print('-' * 20)
+    # the third character from the end is b: 8 DFA states, more than the tiny cache can hold
+    thrashing_dfa = nfa_design.to_lazy_dfa(max_states=2, max_flushes=3)
+    assert thrashing_dfa.is_accepts('abababbaabab' * 10 + 'baa')
+    assert not thrashing_dfa.is_accepts('abababbaabab' * 10 + 'aaa')
+    assert thrashing_dfa.fallbacks == 2
+
+    print('-' * 20)
+    compiled_rulebook = rulebook.compile()
+    assert compiled_rulebook.next_states({1}, 'b') == {1, 2}
+    assert compiled_rulebook.next_states({1, 2}, 'a') == {1, 3}
+    assert compiled_rulebook.next_states({1, 3}, 'b') == {1, 2, 4}
+    assert compiled_rulebook.next_states({1, 3}, 'c') == set()
+    compiled_design = nfa_design.compiled()
+    for string in ['', 'bab', 'bbbbb', 'bbabb', 'abbaab', 'babbbab']:
+        assert compiled_design.is_accepts(string) == nfa_design.is_accepts(string)
+    assert compiled_design.to_dfa_design().state_count() == 8
+    # a large random NFA compiles in time and memory linear in states and classes
+    random = Random(0)
+    large_rules = [FARule(random.randrange(2000), random.choice('abcdefghijklmnopqrstuvwxyz'), random.randrange(2000))
+                   for _ in range(8000)]
+    large_design = NFADesign(0, list(range(0, 2000, 7)), NFARulebook(large_rules))
+    compiled_large = large_design.compiled()
+    for string in ['', 'abc', 'hello', 'zzzzzz', 'thequickbrownfox']:
+        assert compiled_large.is_accepts(string) == large_design.is_accepts(string)
+
+    print('-' * 20)
+    # state 1 loops on every character, so each match starts at 0 and ends two after a b
+    assert nfa_design.search('aabaa') == (0, 5)
+    assert list(nfa_design.find_all('abbbaa')) == [(0, 4), (0, 5), (0, 6)]
+    # without the loop a match is a b followed by any two characters
+    assert list(NFADesign(1, [4], NFARulebook(rulebook.rules[2:])).find_all('abbbaab')) == [(1, 4), (2, 5), (3, 6)]
@@ -1,3 +1,6 @@
+from DFA.dfa import match_spans
+
+
 class FARule:
     def __init__(self, state, character, next_state):
         self.state = state
@@ -17,6 +20,7 @@ class FARule:
 class NFARulebook:
     def __init__(self, rules):
         self.rules = rules
+        self.closures = None
     
     def next_states(self, states, character):
         res = set()
@@ -26,12 +30,37 @@ class NFARulebook:
         return res
 
     def follow_free_moves(self, states):
-        more_states = self.next_states(states, None)
-        
-        if all(s in states for s in more_states):
-            return states
-        else:
-            return self.follow_free_moves(states | more_states)
+        if self.closures is None:
+            self.closures = self.free_move_closures()
+        res = set(states)
+        for state in states:
+            res |= self.closures.get(state, set())
+        return res
+
+    def free_move_closures(self):
+        """Every state reachable from each state by free moves alone, found with an iterative worklist"""
+        free_moves = {}
+        for rule in self.rules:
+            free_moves.setdefault(rule.state, set())
+            free_moves.setdefault(rule.next_state, set())
+            if rule.character is None:
+                free_moves[rule.state].add(rule.next_state)
+        closures = {}
+        for state in free_moves:
+            closure = {state}
+            worklist = [state]
+            while worklist:
+                current = worklist.pop()
+                if current in closures:
+                    # reuse a closure that is already complete instead of walking it again
+                    closure |= closures[current]
+                    continue
+                for next_state in free_moves[current]:
+                    if next_state not in closure:
+                        closure.add(next_state)
+                        worklist.append(next_state)
+            closures[state] = frozenset(closure)
+        return closures
         
     def follow_rules_for(self, state, character):
         res = []
@@ -58,11 +87,11 @@ class NFA:
         return self.current_states
 
     def is_accepting(self):
-        intersect = self.current_states.intersection(self.accept_states)
+        intersect = self.current_states_().intersection(self.accept_states)
         return len(intersect) > 0
 
     def read_character(self, character):
-        self.current_states = rulebook.next_states(self.current_states_(), character)
+        self.current_states = self.rulebook.next_states(self.current_states_(), character)
         return self.current_states
     
     def read_string(self, string):
@@ -85,6 +114,42 @@ class NFADesign:
         nfa.read_string(string)
         return nfa.is_accepting()
 
+    def find_all(self, string):
+        rulebook = self.rulebook
+        moves = {}
+        for rule in rulebook.rules:
+            if rule.character is not None:
+                moves.setdefault((rule.state, rule.character), set()).add(rule.next_state)
+        # every run stays closed under free moves, so acceptance can be checked state by state
+        return match_spans(rulebook.follow_free_moves({self.start_state}),
+                           lambda state, char: rulebook.follow_free_moves(moves.get((state, char), set())),
+                           lambda state: state in self.accept_states, string)
+
+    def search(self, string):
+        return next(self.find_all(string), None)
+
+    def without_free_moves(self):
+        """An equivalent design with no free moves, each rule lands on the closure of its target"""
+        rulebook = self.rulebook
+        characters = []
+        for rule in rulebook.rules:
+            if rule.character is not None and rule.character not in characters:
+                characters.append(rule.character)
+        states = [self.start_state]
+        seen = {self.start_state}
+        rules = []
+        for state in states:
+            closure = rulebook.follow_free_moves({state})
+            for character in characters:
+                for next_state in rulebook.follow_free_moves(rulebook.next_states(closure, character)):
+                    rules.append(FARule(state, character, next_state))
+                    if next_state not in seen:
+                        seen.add(next_state)
+                        states.append(next_state)
+        accept_states = [state for state in states
+                         if any(s in self.accept_states for s in rulebook.follow_free_moves({state}))]
+        return NFADesign(self.start_state, accept_states, NFARulebook(rules))
+
 
 if __name__ == "__main__":
     print('-' * 20)
@@ -106,4 +171,33 @@ if __name__ == "__main__":
     print(nfa_design.is_accepts('aa'))     # True
     print(nfa_design.is_accepts('aaa'))    # True
     print(nfa_design.is_accepts('aaaaa'))  # False
-    print(nfa_design.is_accepts('aaaaaa')) # True
\ No newline at end of file
+    print(nfa_design.is_accepts('aaaaaa')) # True
+
+    print('-' * 20)
+    # a chain of free moves far longer than the recursion limit
+    chain_rulebook = NFARulebook([FARule(n, None, n + 1) for n in range(5000)] + [FARule(5000, 'a', 5001)])
+    assert len(chain_rulebook.follow_free_moves({0})) == 5001
+    assert NFADesign(0, [5001], chain_rulebook).is_accepts('a')
+    assert not NFADesign(0, [5001], chain_rulebook).is_accepts('aa')
+
+    print('-' * 20)
+    # free moves that loop back on themselves
+    cycle_rulebook = NFARulebook([
+        FARule(1, None, 2), FARule(2, None, 3), FARule(3, None, 1),
+        FARule(3, 'a', 4), FARule(4, None, 5),
+    ])
+    assert cycle_rulebook.follow_free_moves({2}) == {1, 2, 3}
+    assert NFADesign(1, [5], cycle_rulebook).is_accepts('a')
+
+    print('-' * 20)
+    free_design = nfa_design.without_free_moves()
+    assert all(rule.character is not None for rule in free_design.rulebook.rules)
+    for string in ['', 'a', 'aa', 'aaa', 'aaaa', 'aaaaa', 'aaaaaa', 'aaaaaaa']:
+        assert free_design.is_accepts(string) == nfa_design.is_accepts(string)
+    assert NFADesign(1, [5], cycle_rulebook).without_free_moves().is_accepts('a')
+
+    print('-' * 20)
+    # runs of a whose length is a multiple of 2 or 3, including the empty run at every position
+    assert nfa_design.search('baaab') == (0, 0)
+    assert list(nfa_design.find_all('baab')) == [(0, 0), (1, 1), (2, 2), (1, 3), (4, 4)]
+    assert list(NFADesign(1, [5], cycle_rulebook).find_all('xaxa')) == [(1, 2), (3, 4)]
@@ -0,0 +1,282 @@
+from functools import lru_cache
+from itertools import count
+
+from NFA.nfa_epsilon import FARule, NFARulebook, NFADesign
+
+
+class Pattern:
+    """Regular expression syntax tree, turned into an NFA with free moves by Thompson's construction"""
+    def bracket(self, outer_precedence):
+        if self.precedence < outer_precedence:
+            return f'({self})'
+        return str(self)
+
+    def to_nfa_design(self):
+        rules = []
+        start_state, accept_state = self.build(count(), rules)
+        return NFADesign(start_state, [accept_state], NFARulebook(rules))
+
+    def matches(self, string):
+        return self.to_nfa_design().is_accepts(string)
+
+
+class Empty(Pattern):
+    precedence = 3
+
+    def __str__(self):
+        return ''
+
+    def build(self, states, rules):
+        start_state, accept_state = next(states), next(states)
+        rules.append(FARule(start_state, None, accept_state))
+        return start_state, accept_state
+
+
+class Literal(Pattern):
+    precedence = 3
+
+    def __init__(self, character):
+        self.character = character
+
+    def __str__(self):
+        if self.character in SPECIAL_CHARACTERS:
+            return '\\' + self.character
+        return self.character
+
+    def build(self, states, rules):
+        start_state, accept_state = next(states), next(states)
+        rules.append(FARule(start_state, self.character, accept_state))
+        return start_state, accept_state
+
+
+class CharacterClass(Pattern):
+    precedence = 3
+
+    def __init__(self, characters):
+        self.characters = characters
+
+    def __str__(self):
+        return '[' + ''.join('\\' + char if char in '\\]-^' else char for char in self.characters) + ']'
+
+    def build(self, states, rules):
+        start_state, accept_state = next(states), next(states)
+        for character in self.characters:
+            rules.append(FARule(start_state, character, accept_state))
+        return start_state, accept_state
+
+
+class Concatenate(Pattern):
+    """Any number of patterns in a row, kept in one flat list so long patterns build without recursion"""
+    precedence = 1
+
+    def __init__(self, *patterns):
+        self.patterns = list(patterns)
+
+    def __str__(self):
+        return ''.join(pattern.bracket(self.precedence) for pattern in self.patterns)
+
+    def build(self, states, rules):
+        start_state, accept_state = self.patterns[0].build(states, rules)
+        for pattern in self.patterns[1:]:
+            next_start, next_accept = pattern.build(states, rules)
+            rules.append(FARule(accept_state, None, next_start))
+            accept_state = next_accept
+        return start_state, accept_state
+
+
+class Choose(Pattern):
+    """Any number of alternatives, kept in one flat list like Concatenate"""
+    precedence = 0
+
+    def __init__(self, *patterns):
+        self.patterns = list(patterns)
+
+    def __str__(self):
+        return '|'.join(pattern.bracket(self.precedence) for pattern in self.patterns)
+
+    def build(self, states, rules):
+        start_state = next(states)
+        fragments = [pattern.build(states, rules) for pattern in self.patterns]
+        accept_state = next(states)
+        for inner_start, inner_accept in fragments:
+            rules.append(FARule(start_state, None, inner_start))
+            rules.append(FARule(inner_accept, None, accept_state))
+        return start_state, accept_state
+
+
+class Repeat(Pattern):
+    """Zero or more with '*', one or more with '+', zero or one with '?'"""
+    precedence = 2
+
+    def __init__(self, pattern, operator='*'):
+        self.pattern = pattern
+        self.operator = operator
+
+    def __str__(self):
+        return self.pattern.bracket(self.precedence) + self.operator
+
+    def build(self, states, rules):
+        start_state = next(states)
+        inner_start, inner_accept = self.pattern.build(states, rules)
+        accept_state = next(states)
+        rules.append(FARule(start_state, None, inner_start))
+        rules.append(FARule(inner_accept, None, accept_state))
+        if self.operator in '*?':
+            rules.append(FARule(start_state, None, accept_state))
+        if self.operator in '*+':
+            rules.append(FARule(inner_accept, None, inner_start))
+        return start_state, accept_state
+
+
+SPECIAL_CHARACTERS = set('|*+?()[].\\')
+CLASS_ESCAPES = SPECIAL_CHARACTERS | set('-^')
+
+
+class Parser:
+    """Recursive descent parser for alternation, concatenation, '*', '+', '?', groups and [a-z] classes"""
+    def __init__(self, source):
+        self.source = source
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.source):
+            return self.source[self.position]
+        return None
+
+    def take(self):
+        char = self.peek()
+        if char is None:
+            raise ValueError(f'unexpected end of pattern {self.source!r}')
+        self.position += 1
+        return char
+
+    def escaped(self, allowed):
+        char = self.take()
+        if char not in allowed:
+            raise ValueError(f'unsupported escape \\{char} at {self.position - 2} in pattern {self.source!r}')
+        return char
+
+    def parse(self):
+        pattern = self.choose()
+        if self.peek() is not None:
+            raise ValueError(f'unexpected {self.peek()!r} at {self.position} in pattern {self.source!r}')
+        return pattern
+
+    def choose(self):
+        patterns = [self.concatenate()]
+        while self.peek() == '|':
+            self.take()
+            patterns.append(self.concatenate())
+        return patterns[0] if len(patterns) == 1 else Choose(*patterns)
+
+    def concatenate(self):
+        patterns = []
+        while self.peek() is not None and self.peek() not in '|)':
+            patterns.append(self.repeat())
+        if not patterns:
+            return Empty()
+        return patterns[0] if len(patterns) == 1 else Concatenate(*patterns)
+
+    def repeat(self):
+        pattern = self.atom()
+        while self.peek() is not None and self.peek() in '*+?':
+            pattern = Repeat(pattern, self.take())
+        return pattern
+
+    def atom(self):
+        char = self.take()
+        if char == '(':
+            pattern = self.choose()
+            if self.peek() != ')':
+                raise ValueError(f'missing ) at {self.position} in pattern {self.source!r}')
+            self.take()
+            return pattern
+        if char == '[':
+            return self.character_class()
+        if char == '\\':
+            return Literal(self.escaped(SPECIAL_CHARACTERS))
+        if char == '.':
+            raise ValueError(f'the . wildcard is not supported in pattern {self.source!r}')
+        if char in SPECIAL_CHARACTERS:
+            raise ValueError(f'unexpected {char!r} at {self.position - 1} in pattern {self.source!r}')
+        return Literal(char)
+
+    def character_class(self):
+        if self.peek() == '^':
+            raise ValueError(f'negated character classes are not supported in pattern {self.source!r}')
+        characters = []
+        while self.peek() != ']':
+            char = self.take()
+            if char == '\\':
+                char = self.escaped(CLASS_ESCAPES)
+            if self.peek() == '-' and self.source[self.position + 1:self.position + 2] not in ('', ']'):
+                self.take()
+                last = self.take()
+                if last == '\\':
+                    last = self.escaped(CLASS_ESCAPES)
+                if ord(last) < ord(char):
+                    raise ValueError(f'bad range {char}-{last} in pattern {self.source!r}')
+                characters.extend(chr(point) for point in range(ord(char), ord(last) + 1))
+            else:
+                characters.append(char)
+        self.take()
+        return CharacterClass(list(dict.fromkeys(characters)))
+
+
+def parse(source):
+    return Parser(source).parse()
+
+
+@lru_cache(maxsize=512)
+def compile_pattern(source):
+    """Parsed and constructed NFADesign for a pattern, the most recently used ones are cached"""
+    return parse(source).to_nfa_design()
+
+
+def matches(source, string):
+    return compile_pattern(source).is_accepts(string)
+
+
+if __name__ == "__main__":
+    print('-' * 20)
+    pattern = Repeat(Choose(Concatenate(Literal('a'), Literal('b')), Literal('a')))
+    print(pattern)  # (ab|a)*
+    assert str(pattern) == '(ab|a)*'
+    assert pattern.matches('')
+    assert pattern.matches('abaab')
+    assert not pattern.matches('abba')
+
+    print('-' * 20)
+    assert str(parse('(a(|b))*')) == '(a(|b))*'
+    assert str(parse('a|b+c?')) == 'a|b+c?'
+    assert str(parse('[a-c_]\\*')) == '[abc_]\\*'
+    assert matches('(a(|b))*', 'abaab')
+    assert not matches('(a(|b))*', 'abba')
+    assert matches('[a-z_][a-z0-9_]*', 'snake_case_2')
+    assert not matches('[a-z_][a-z0-9_]*', '2snake')
+    assert matches('colou?r', 'color') and matches('colou?r', 'colour')
+    assert matches('x+', 'xxx') and not matches('x+', '')
+    assert matches('\\(\\)', '()')
+    assert matches('a\\.c', 'a.c') and not matches('a\\.c', 'abc')
+    assert str(parse('[.\\^]\\.')) == '[.\\^]\\.'
+    for source in ['(ab', 'a)', '*a', '[a-', '[^a]', 'a.c', r'\d', r'[\w]', '\\']:
+        try:
+            parse(source)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f'{source} should not parse')
+
+    print('-' * 20)
+    # long concatenations and alternations are flat, so they are not limited by the recursion depth
+    assert matches('a' * 1000 + 'b*', 'a' * 1000 + 'bb') and not matches('a' * 5000, 'b')
+    assert str(parse('a' * 5000)) == 'a' * 5000
+    keywords = '|'.join(f'k{number}w' for number in range(300))
+    assert matches(keywords, 'k299w') and not matches(keywords, 'k300w')
+    assert str(parse(keywords)) == keywords
+
+    print('-' * 20)
+    compile_pattern.cache_clear()
+    assert compile_pattern('(ab|a)*') is compile_pattern('(ab|a)*')
+    assert compile_pattern.cache_info().hits == 1
+    assert compile_pattern('(ab|a)*').without_free_moves().is_accepts('aab')
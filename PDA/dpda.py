@@ -1,16 +1,38 @@
-from stack import Stack
+import sys
+
+from stack import Stack, InternTable
 
 class PDAConfiguration:
+    """Hash-consed like Stack, so equal configurations are normally the same object"""
     STUCK_STATE = float('-inf')
-    def __init__(self, state, stack):
-        self.state = state
-        self.stack = stack
+    intern_table = InternTable()
+
+    def __new__(cls, state, stack):
+        # the configuration keeps its stack alive for as long as the entry exists, so the stack's id is a safe key
+        table = PDAConfiguration.intern_table
+        key = (state, id(stack))
+        configuration = table.objects.get(key)
+        if configuration is None:
+            return table.intern(key, PDAConfiguration.make, state, stack)
+        table.hits += 1
+        return configuration
+
+    @staticmethod
+    def make(state, stack):
+        configuration = object.__new__(PDAConfiguration)
+        configuration.state = state
+        configuration.stack = stack
+        configuration.hash_ = hash(hash(state) + hash(stack))
+        return configuration
+
+    def __reduce__(self):
+        return PDAConfiguration, (self.state, self.stack)
     
     def __eq__(self, other):
-        return self.state == other.state and self.stack == other.stack
+        return self is other or (self.state == other.state and self.stack == other.stack)
     
     def __hash__(self):
-        return hash(hash(self.state) + hash(self.stack))
+        return self.hash_
     
     def __str__(self):
         return f'<PDAConfiguration state={self.state}, stack={str(self.stack)}>'
@@ -38,30 +60,83 @@ class PDARule:
         return PDAConfiguration(self.next_state, self.next_stack(configuration))
     
     def next_stack(self, configuration):
-        popped_stack = configuration.stack.pop()
-        return Stack(self.push_character + popped_stack.stk)
+        return configuration.stack.pop().push_all(self.push_character)
 
 
-class DPDARulebook:
+class PDARuleIndex:
+    """Rules keyed on (state, character, stack top), with free moves in an index of their own"""
     def __init__(self, rules):
+        self.rules = {}
+        self.free_rules = {}
+        for rule in rules:
+            if rule.character is None:
+                self.free_rules.setdefault((rule.state, rule.pop_character), []).append(rule)
+            else:
+                self.rules.setdefault((rule.state, rule.character, rule.pop_character), []).append(rule)
+
+    def rules_for(self, configuration, character):
+        stack = configuration.stack
+        if not stack.size:
+            return []
+        if character is None:
+            return self.free_rules.get((configuration.state, stack.head), [])
+        return self.rules.get((configuration.state, character, stack.head), [])
+
+
+class DivergenceError(Exception):
+    """Free moves that loop forever or grow past the configured bounds"""
+
+
+class FreeMoveBounds:
+    """Limits for one chain of free moves: how many steps it takes, and how far it grows the stack
+    past the depth it started from"""
+    MAX_STEPS = 100000
+    MAX_STACK_DEPTH = 100000
+
+    def __init__(self, max_steps=MAX_STEPS, max_stack_depth=MAX_STACK_DEPTH):
+        self.max_steps = max_steps
+        self.max_stack_depth = max_stack_depth
+
+    def check(self, steps, start_depth, configuration):
+        if steps > self.max_steps:
+            raise DivergenceError(f'more than {self.max_steps} free moves from {configuration}')
+        if configuration.stack.size - start_depth > self.max_stack_depth:
+            raise DivergenceError(f'stack grew by more than {self.max_stack_depth} in free moves, '
+                                  f'in state {configuration.state}')
+
+
+class DPDARulebook:
+    def __init__(self, rules, bounds=None):
         self.rules = rules
+        self.index = PDARuleIndex(rules)
+        self.bounds = bounds or FreeMoveBounds()
     
     def next_configuration(self, configuration, character):
         return self.rule_for(configuration, character).follow(configuration)
     
     def rule_for(self, configuration, character):
-        for rule in self.rules:
-            if rule.is_applies_to(configuration, character):
-                return rule
+        rules = self.index.rules_for(configuration, character)
+        if rules:
+            return rules[0]
     
     def is_applies_to(self, configuration, character):
         return self.rule_for(configuration, character) is not None
     
     def follow_free_moves(self, configuration):
-        if self.is_applies_to(configuration, None):
-            return self.follow_free_moves(self.next_configuration(configuration, None))
-        else:
-            return configuration
+        # a deterministic machine that comes back to a configuration will go round forever
+        seen = set()
+        steps = 0
+        start_depth = configuration.stack.size
+        while True:
+            rule = self.rule_for(configuration, None)
+            if rule is None:
+                return configuration
+            if configuration in seen:
+                raise DivergenceError(f'free moves loop forever through {configuration}')
+            seen.add(configuration)
+            configuration = rule.follow(configuration)
+            steps += 1
+            self.bounds.check(steps, start_depth, configuration)
 
 
 class DPDA:
@@ -71,7 +146,7 @@ class DPDA:
         self.rulebook = rulebook
 
     def current_configuration_(self):
-        self.current_configuration = rulebook.follow_free_moves(self.current_configuration)
+        self.current_configuration = self.rulebook.follow_free_moves(self.current_configuration)
         return self.current_configuration
 
     def is_accepting(self):
@@ -87,10 +162,12 @@ class DPDA:
                 self.read_character(char) 
         
     def next_configuration(self, character):
-        if self.rulebook.is_applies_to(self.current_configuration_(), character):
-            return self.rulebook.next_configuration(self.current_configuration_(), character)
+        configuration = self.current_configuration_()
+        rule = self.rulebook.rule_for(configuration, character)
+        if rule is not None:
+            return rule.follow(configuration)
         else:
-            return self.current_configuration.stuck()
+            return configuration.stuck()
     
     def is_stuck(self):
         return self.current_configuration.is_stuck()
@@ -114,6 +191,40 @@ class DPDADesign:
         return DPDA(start_configuration, self.accept_states, self.rulebook)
 
 
+def bracket_design(kinds):
+    """A DPDA for balanced strings over the given number of bracket kinds, about kinds² rules"""
+    opens = [chr(0x100 + 2 * kind) for kind in range(kinds)]
+    closes = [chr(0x101 + 2 * kind) for kind in range(kinds)]
+    rules = []
+    for open_, close in zip(opens, closes):
+        rules.append(PDARule(1, open_, 2, '$', [open_, '$']))
+        rules.extend(PDARule(2, open_, 2, top, [open_, top]) for top in opens)
+        rules.append(PDARule(2, close, 2, open_, []))
+    rules.append(PDARule(2, None, 1, '$', ['$']))
+    return DPDADesign(1, '$', [1], DPDARulebook(rules)), opens, closes
+
+
+def benchmark(kinds_list=(1, 10, 40, 160), length=20000):
+    import random
+    import time
+
+    print(f'{"rules":>7} {"us/char":>8}')
+    for kinds in kinds_list:
+        design, opens, closes = bracket_design(kinds)
+        chars, stack = [], []
+        while len(chars) < length or stack:
+            if stack and (random.random() < 0.5 or len(chars) + len(stack) >= length):
+                chars.append(closes[stack.pop()])
+            else:
+                stack.append(random.randrange(kinds))
+                chars.append(opens[stack[-1]])
+        string = ''.join(chars)
+        start = time.perf_counter()
+        assert design.is_accepts(string)
+        elapsed = time.perf_counter() - start
+        print(f'{len(design.rulebook.rules):>7} {elapsed / len(string) * 1e6:>8.2f}')
+
+
 if __name__ == "__main__":
     print('-' * 20)
     rule = PDARule(1, '(', 2, '$', ['b', '$'])
@@ -177,4 +288,49 @@ if __name__ == "__main__":
     print('-' * 20)
     c1 = PDAConfiguration(1, Stack(['$']))
     c2 = PDAConfiguration(1, Stack(['$']))
-    assert c1 == c2
\ No newline at end of file
+    assert c1 == c2
+
+    print('-' * 20)
+    design, opens, closes = bracket_design(3)
+    assert design.is_accepts(opens[0] + opens[2] + closes[2] + closes[0] + opens[1] + closes[1])
+    assert not design.is_accepts(opens[0] + opens[2] + closes[0] + closes[2])
+
+    print('-' * 20)
+    # a long chain of free moves
+    chain_rulebook = DPDARulebook([PDARule(n, None, n + 1, '$', ['$']) for n in range(5000)])
+    assert chain_rulebook.follow_free_moves(PDAConfiguration(0, Stack(['$']))).state == 5000
+    # free moves that go round without touching the stack
+    loop_rulebook = DPDARulebook([PDARule(1, None, 2, '$', ['$']), PDARule(2, None, 1, '$', ['$'])])
+    try:
+        loop_rulebook.follow_free_moves(PDAConfiguration(1, Stack(['$'])))
+    except DivergenceError:
+        pass
+    else:
+        raise AssertionError('expected DivergenceError')
+    # free moves that push forever
+    push_rulebook = DPDARulebook([PDARule(1, None, 1, '$', ['$', '$'])], FreeMoveBounds(max_stack_depth=1000))
+    try:
+        DPDADesign(1, '$', [2], push_rulebook).is_accepts('')
+    except DivergenceError:
+        pass
+    else:
+        raise AssertionError('expected DivergenceError')
+    # the depth bound is on growth during free moves, not on what the input has pushed
+    deep_rulebook = DPDARulebook([
+        PDARule(1, 'a', 1, '$', ['a', '$']), PDARule(1, 'a', 1, 'a', ['a', 'a']),
+        PDARule(1, 'b', 2, 'a', ['a']), PDARule(2, None, 3, 'a', ['a']),
+    ], FreeMoveBounds(max_stack_depth=10))
+    assert DPDADesign(1, '$', [3], deep_rulebook).is_accepts('a' * 20 + 'b')
+
+    print('-' * 20)
+    c3 = PDAConfiguration(2, Stack(['b', '$']))
+    assert c3 is rule.follow(PDAConfiguration(1, Stack(['$'])))
+    assert c1 is c2
+    hits = PDAConfiguration.intern_table.hits
+    design, opens, closes = bracket_design(1)
+    assert design.is_accepts(opens[0] * 50 + closes[0] * 50 + opens[0] * 50 + closes[0] * 50)
+    print(PDAConfiguration.intern_table.hits - hits, 'configurations reused')
+    assert PDAConfiguration.intern_table.hits > hits
+
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
@@ -0,0 +1,236 @@
+import sys
+import time
+
+from dpda import PDARule, FreeMoveBounds, DivergenceError
+from npda import NPDARulebook, NPDADesign
+
+
+class Grammar:
+    """Context-free grammar over single-character symbols. productions maps every nonterminal to
+    its right-hand sides, e.g. {'S': ['(S)S', '']}; symbols that are not keys are terminals"""
+    def __init__(self, start_symbol, productions):
+        self.start_symbol = start_symbol
+        self.productions = {symbol: [list(body) for body in bodies] for symbol, bodies in productions.items()}
+
+    def is_nonterminal(self, symbol):
+        return symbol in self.productions
+
+    def terminals(self):
+        return sorted(set(symbol for bodies in self.productions.values() for body in bodies
+                          for symbol in body if not self.is_nonterminal(symbol)))
+
+    def nullable(self):
+        res = set()
+        changed = True
+        while changed:
+            changed = False
+            for symbol, bodies in self.productions.items():
+                if symbol not in res and any(all(part in res for part in body) for body in bodies):
+                    res.add(symbol)
+                    changed = True
+        return res
+
+    def is_cnf(self):
+        """Every body is one terminal or two nonterminals, and only the start symbol may be empty"""
+        for symbol, bodies in self.productions.items():
+            for body in bodies:
+                if len(body) == 1 and not self.is_nonterminal(body[0]):
+                    continue
+                if len(body) == 2 and all(self.is_nonterminal(part) for part in body):
+                    continue
+                if not body and symbol == self.start_symbol:
+                    continue
+                return False
+        return True
+
+    def to_npda_design(self, bounds=None):
+        """The top-down NPDA: expand the nonterminal on top of the stack, match the terminal on top"""
+        rules = [PDARule(1, None, 2, '$', [self.start_symbol, '$'])]
+        for symbol, bodies in self.productions.items():
+            rules.extend(PDARule(2, None, 2, symbol, body) for body in bodies)
+        rules.extend(PDARule(2, terminal, 2, terminal, []) for terminal in self.terminals())
+        rules.append(PDARule(2, None, 3, '$', ['$']))
+        return NPDADesign(1, '$', [3], NPDARulebook(rules, bounds))
+
+    def design(self, engine='earley'):
+        """Something with is_accepts(string): 'npda', 'gss', 'earley' or 'cyk' for grammars in CNF"""
+        if engine == 'npda':
+            return self.to_npda_design()
+        if engine == 'gss':
+            return GSSDesign(self.to_npda_design())
+        if engine == 'earley':
+            return EarleyRecognizer(self)
+        if engine == 'cyk':
+            return CYKRecognizer(self)
+        raise ValueError(f'expected engine \'npda\', \'gss\', \'earley\' or \'cyk\', {engine} countered')
+
+
+class GSSDesign:
+    def __init__(self, npda_design):
+        self.npda_design = npda_design
+
+    def is_accepts(self, string):
+        gss_npda = self.npda_design.to_gss_npda()
+        gss_npda.read_string(string)
+        return gss_npda.is_accepting()
+
+
+class EarleyRecognizer:
+    """Earley's algorithm, O(n^3) for any grammar. An item is (symbol, body index, dot, origin);
+    predicting a nullable nonterminal also moves the dot over it (Aycock and Horspool)"""
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.nullable = grammar.nullable()
+
+    def is_accepts(self, string):
+        grammar = self.grammar
+        productions = grammar.productions
+        chart = [set() for _ in range(len(string) + 1)]
+        start = grammar.start_symbol
+        for index in range(len(productions[start])):
+            chart[0].add((start, index, 0, 0))
+        for position in range(len(string) + 1):
+            items = chart[position]
+            worklist = list(items)
+            while worklist:
+                symbol, index, dot, origin = worklist.pop()
+                body = productions[symbol][index]
+                new_items = []
+                if dot == len(body):
+                    # complete: move every item waiting on this symbol at the origin
+                    for waiting_symbol, waiting_index, waiting_dot, waiting_origin in list(chart[origin]):
+                        waiting_body = productions[waiting_symbol][waiting_index]
+                        if waiting_dot < len(waiting_body) and waiting_body[waiting_dot] == symbol:
+                            new_items.append((waiting_symbol, waiting_index, waiting_dot + 1, waiting_origin))
+                elif grammar.is_nonterminal(body[dot]):
+                    # predict
+                    following = body[dot]
+                    new_items.extend((following, following_index, 0, position)
+                                     for following_index in range(len(productions[following])))
+                    if following in self.nullable:
+                        new_items.append((symbol, index, dot + 1, origin))
+                elif position < len(string) and body[dot] == string[position]:
+                    # scan
+                    chart[position + 1].add((symbol, index, dot + 1, origin))
+                for item in new_items:
+                    if item not in items:
+                        items.add(item)
+                        worklist.append(item)
+        return any(symbol == start and dot == len(productions[symbol][index]) and origin == 0
+                   for symbol, index, dot, origin in chart[len(string)])
+
+
+class CYKRecognizer:
+    """Cocke-Younger-Kasami, O(n^3) for grammars in Chomsky normal form"""
+    def __init__(self, grammar):
+        if not grammar.is_cnf():
+            raise ValueError('CYK needs a grammar in Chomsky normal form')
+        self.grammar = grammar
+        self.terminal_symbols = {}
+        self.pair_symbols = {}
+        for symbol, bodies in grammar.productions.items():
+            for body in bodies:
+                if len(body) == 1:
+                    self.terminal_symbols.setdefault(body[0], set()).add(symbol)
+                elif len(body) == 2:
+                    self.pair_symbols.setdefault(tuple(body), set()).add(symbol)
+
+    def is_accepts(self, string):
+        if not string:
+            return [] in self.grammar.productions[self.grammar.start_symbol]
+        # table[length - 1][start] holds the symbols that derive string[start:start + length]
+        table = [[set(self.terminal_symbols.get(char, ())) for char in string]]
+        for length in range(2, len(string) + 1):
+            row = []
+            for start in range(len(string) - length + 1):
+                symbols = set()
+                for split in range(1, length):
+                    for left in table[split - 1][start]:
+                        for right in table[length - split - 1][start + split]:
+                            symbols |= self.pair_symbols.get((left, right), set())
+                row.append(symbols)
+            table.append(row)
+        return self.grammar.start_symbol in table[-1][0]
+
+
+def benchmark(lengths=(8, 16, 32, 64)):
+    grammars = [
+        ('unambiguous', Grammar('S', {'S': ['(S)S', '']}), lambda n: '()' * (n // 2)),
+        ('right recursive', Grammar('S', {'S': ['aS', 'aSb', '']}), lambda n: 'a' * (n - n // 3) + 'b' * (n // 3)),
+        ('ambiguous', Grammar('S', {'S': ['SS', 'LR', 'LT'], 'T': ['SR'], 'L': ['('], 'R': [')']}),
+         lambda n: '()' * (n // 2)),
+        ('highly ambiguous', Grammar('S', {'S': ['SS', 'SU', 'a'], 'U': ['SS']}), lambda n: 'a' * n),
+    ]
+    print(f'{"grammar":>16} {"length":>6} ' + ' '.join(f'{engine:>8}' for engine in ('npda', 'gss', 'earley', 'cyk')))
+    for name, grammar, make_string in grammars:
+        for length in lengths:
+            string = make_string(length)
+            timings = []
+            for engine in ('npda', 'gss', 'earley', 'cyk'):
+                if engine == 'cyk' and not grammar.is_cnf():
+                    timings.append('-')
+                    continue
+                start = time.perf_counter()
+                try:
+                    if engine == 'npda':
+                        design = grammar.to_npda_design(FreeMoveBounds(max_steps=100000, max_stack_depth=4 * length))
+                    else:
+                        design = grammar.design(engine)
+                    assert design.is_accepts(string)
+                    timings.append(f'{time.perf_counter() - start:.4f}')
+                except DivergenceError:
+                    timings.append('diverges')
+            print(f'{name:>16} {length:>6} ' + ' '.join(f'{timing:>8}' for timing in timings))
+
+
+if __name__ == "__main__":
+    print('-' * 20)
+    brackets = Grammar('S', {'S': ['(S)S', '']})
+    for engine in ('npda', 'gss', 'earley'):
+        design = brackets.design(engine)
+        assert design.is_accepts('')
+        assert design.is_accepts('(()(()))()')
+        assert not design.is_accepts('(()')
+        assert not design.is_accepts('())(')
+
+    print('-' * 20)
+    # the arithmetic grammar from the book
+    arithmetic = Grammar('S', {
+        'S': ['W', 'A'],
+        'W': ['w(E){S}'],
+        'A': ['v=E'],
+        'E': ['L'],
+        'L': ['M<L', 'M'],
+        'M': ['T*M', 'T'],
+        'T': ['n', 'v'],
+    })
+    for engine in ('npda', 'gss', 'earley'):
+        design = arithmetic.design(engine)
+        assert design.is_accepts('w(v<n){v=v*n}')
+        assert not design.is_accepts('w(v<n){v=v*}')
+
+    print('-' * 20)
+    # left recursion sends the top-down NPDA into free moves that push forever
+    ambiguous = Grammar('S', {'S': ['SS', 'LR', 'LT'], 'T': ['SR'], 'L': ['('], 'R': [')']})
+    assert ambiguous.is_cnf()
+    assert not brackets.is_cnf()
+    for engine in ('gss', 'earley', 'cyk'):
+        design = ambiguous.design(engine)
+        assert design.is_accepts('(()())()')
+        assert not design.is_accepts('(()()()')
+        assert not design.is_accepts('')
+    try:
+        ambiguous.to_npda_design(FreeMoveBounds(max_stack_depth=100)).is_accepts('()')
+    except DivergenceError:
+        pass
+    else:
+        raise AssertionError('expected DivergenceError')
+    try:
+        brackets.design('cyk')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('expected ValueError')
+
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
@@ -0,0 +1,150 @@
+from dpda import PDARule, PDARuleIndex
+
+
+class GSSNode:
+    """One stack cell shared by every stack that has it, the stacks below it are its predecessors"""
+    __slots__ = ('symbol', 'predecessors')
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.predecessors = set()
+
+
+class GSSNPDA:
+    """NPDA simulation over a graph-structured stack, GLR style. A head is a (state, top node) pair.
+    Cells pushed at the same input position are merged when they hold the same symbol under the
+    same state, so configurations with the same state and stack top become one head"""
+    def __init__(self, start_state, bottom_character, accept_states, rulebook):
+        self.accept_states = accept_states
+        self.index = PDARuleIndex(rulebook.rules)
+        # the cell under the bottom character, a head on it has an empty stack
+        self.bottom = GSSNode(None)
+        start = GSSNode(bottom_character)
+        start.predecessors.add(self.bottom)
+        self.nodes = {}
+        self.heads = self.follow_free_moves({(start_state, start)})
+
+    def push(self, rule, base, changed):
+        """Push the rule's characters onto base, reusing cells already pushed at this position"""
+        below = base
+        for depth in reversed(range(len(rule.push_character))):
+            if depth == 0:
+                key = ('top', rule.push_character[0], rule.next_state)
+            else:
+                key = (id(rule), depth)
+            node = self.nodes.get(key)
+            if node is None:
+                node = self.nodes[key] = GSSNode(rule.push_character[depth])
+            if below not in node.predecessors:
+                node.predecessors.add(below)
+                changed.append(node)
+            below = node
+        return below
+
+    def follow(self, rule, node, changed):
+        for base in list(node.predecessors):
+            yield rule.next_state, self.push(rule, base, changed)
+
+    def follow_free_moves(self, heads):
+        res = set(heads)
+        states_on = {}
+        for state, node in heads:
+            states_on.setdefault(node, set()).add(state)
+        worklist = list(heads)
+        while worklist:
+            state, node = worklist.pop()
+            for rule in self.index.free_rules.get((state, node.symbol), []):
+                changed = []
+                for head in list(self.follow(rule, node, changed)):
+                    if head not in res:
+                        res.add(head)
+                        states_on.setdefault(head[1], set()).add(head[0])
+                        worklist.append(head)
+                # a cell that gained a predecessor gives its heads new stacks to pop into
+                for changed_node in changed:
+                    worklist.extend((changed_state, changed_node) for changed_state in states_on.get(changed_node, ()))
+        return res
+
+    def read_character(self, character):
+        self.nodes = {}
+        changed = []
+        heads = set()
+        for state, node in self.heads:
+            for rule in self.index.rules.get((state, character, node.symbol), []):
+                heads.update(self.follow(rule, node, changed))
+        self.heads = self.follow_free_moves(heads)
+
+    def read_string(self, string):
+        for char in string:
+            if not self.heads:
+                break
+            self.read_character(char)
+
+    def is_accepting(self):
+        return any(state in self.accept_states for state, _ in self.heads)
+
+
+if __name__ == "__main__":
+    from random import Random
+
+    from npda import NPDARulebook, NPDADesign
+
+    rulebook = NPDARulebook([
+        PDARule(1, 'a', 1, '$', ['a', '$']),
+        PDARule(1, 'a', 1, 'a', ['a', 'a']),
+        PDARule(1, 'a', 1, 'b', ['a', 'b']),
+        PDARule(1, 'b', 1, '$', ['b', '$']),
+        PDARule(1, 'b', 1, 'a', ['b', 'a']),
+        PDARule(1, 'b', 1, 'b', ['b', 'b']),
+        PDARule(1, None, 2, '$', ['$']),
+        PDARule(1, None, 2, 'a', ['a']),
+        PDARule(1, None, 2, 'b', ['b']),
+        PDARule(2, 'a', 2, 'a', []),
+        PDARule(2, 'b', 2, 'b', []),
+        PDARule(2, None, 3, '$', ['$']),
+    ])
+    npda_design = NPDADesign(1, '$', [3], rulebook)
+
+    print('-' * 20)
+    for string in ['', 'abba', 'babbaabbab', 'abb', 'baabaa', 'aa', 'aba']:
+        gss = GSSNPDA(1, '$', [3], rulebook)
+        gss.read_string(string)
+        assert gss.is_accepting() == npda_design.is_accepts(string), string
+
+    print('-' * 20)
+    random = Random(0)
+    for _ in range(200):
+        half = ''.join(random.choice('ab') for _ in range(random.randrange(6)))
+        string = random.choice([half + half[::-1], half + random.choice('ab') + half[::-1], half + 'ab'])
+        gss = GSSNPDA(1, '$', [3], rulebook)
+        gss.read_string(string)
+        assert gss.is_accepting() == npda_design.is_accepts(string), string
+
+    print('-' * 20)
+    # a free move that pushes forever just turns into a cell that is its own predecessor
+    loop_rulebook = NPDARulebook([
+        PDARule(1, None, 1, '$', ['x', '$']), PDARule(1, None, 1, 'x', ['x', 'x']),
+        PDARule(1, 'a', 2, 'x', []), PDARule(2, 'b', 3, '$', ['$']),
+    ])
+    gss = GSSNPDA(1, '$', [3], loop_rulebook)
+    gss.read_string('ab')
+    assert gss.is_accepting()
+
+    print('-' * 20)
+    # every a pushes x or y, so after n a's the NPDA holds 2**n configurations with different stacks,
+    # while the graph-structured stack keeps one head per state and stack top
+    choice_rulebook = NPDARulebook(
+        [PDARule(1, 'a', 1, top, [push, top]) for top in '$xy' for push in 'xy'] +
+        [PDARule(1, 'b', 2, top, []) for top in 'xy'] +
+        [PDARule(2, 'b', 2, top, []) for top in 'xy'] +
+        [PDARule(2, None, 3, '$', ['$'])]
+    )
+    npda = NPDADesign(1, '$', [3], choice_rulebook).to_dpda()
+    npda.read_string('a' * 12)
+    gss = GSSNPDA(1, '$', [3], choice_rulebook)
+    gss.read_string('a' * 12)
+    print(len(npda.current_configurations), len(gss.heads))  # 4096 2
+    assert len(npda.current_configurations) == 4096
+    assert len(gss.heads) == 2
+    gss.read_string('b' * 12)
+    assert gss.is_accepting()
@@ -1,10 +1,13 @@
 from stack import Stack
-from dpda import PDARule, PDAConfiguration 
+from dpda import PDARule, PDAConfiguration, PDARuleIndex, DivergenceError, FreeMoveBounds
+from gss import GSSNPDA
 from time import sleep
 
 class NPDARulebook:
-    def __init__(self, rules):
+    def __init__(self, rules, bounds=None):
         self.rules = rules
+        self.index = PDARuleIndex(rules)
+        self.bounds = bounds or FreeMoveBounds()
     
     def next_configurations(self, configurations, character):
         res = set()
@@ -14,11 +17,18 @@ class NPDARulebook:
         return res
 
     def follow_free_moves(self, configurations):
-        more_configurations = self.next_configurations(configurations, None)
-        if more_configurations.issubset(configurations):
-            return configurations
-        else:
-            return self.follow_free_moves(configurations | more_configurations)
+        res = set(configurations)
+        # each entry carries how many free moves led to it and the stack depth its chain started at,
+        # so the bounds apply to one chain and not to the whole set
+        worklist = [(configuration, 0, configuration.stack.size) for configuration in configurations]
+        while worklist:
+            configuration, steps, start_depth = worklist.pop()
+            for next_configuration in self.follow_rules_for(configuration, None):
+                self.bounds.check(steps + 1, start_depth, next_configuration)
+                if next_configuration not in res:
+                    res.add(next_configuration)
+                    worklist.append((next_configuration, steps + 1, start_depth))
+        return res
         
     def follow_rules_for(self, configuration, character):
         res = []
@@ -27,11 +37,7 @@ class NPDARulebook:
         return res
     
     def rules_for(self, configuration, character):
-        res = []
-        for rule in self.rules:
-            if rule.is_applies_to(configuration, character):
-                res.append(rule)
-        return res
+        return self.index.rules_for(configuration, character)
 
 
 class NPDA:
@@ -51,7 +57,7 @@ class NPDA:
         return len(intersect) > 0
 
     def read_character(self, character):
-        self.current_configurations = rulebook.next_configurations(self.current_configurations_(), character)
+        self.current_configurations = self.rulebook.next_configurations(self.current_configurations_(), character)
     
     def read_string(self, string):
         for char in string:
@@ -74,6 +80,9 @@ class NPDADesign:
         start_configuration = PDAConfiguration(self.start_state, start_stack)
         return NPDA(set([start_configuration]), self.accept_states, self.rulebook)
 
+    def to_gss_npda(self):
+        return GSSNPDA(self.start_state, self.bottom_character, self.accept_states, self.rulebook)
+
 if __name__ == "__main__":
     rulebook = NPDARulebook([
         PDARule(1, 'a', 1, '$', ['a', '$']),
@@ -102,4 +111,31 @@ if __name__ == "__main__":
     assert npda_design.is_accepts('abba')
     assert npda_design.is_accepts('babbaabbab')
     assert not npda_design.is_accepts('abb')
-    assert not npda_design.is_accepts('baabaa')
\ No newline at end of file
+    assert not npda_design.is_accepts('baabaa')
+
+    gss_npda = npda_design.to_gss_npda()
+    gss_npda.read_string('babbaabbab')
+    assert gss_npda.is_accepting()
+
+    print('-' * 20)
+    # free moves that go round in a cycle are fine for an NPDA, each configuration is visited once
+    cycle_rulebook = NPDARulebook([
+        PDARule(1, None, 2, '$', ['$']), PDARule(2, None, 1, '$', ['$']), PDARule(2, 'a', 3, '$', ['$']),
+    ])
+    assert NPDADesign(1, '$', [3], cycle_rulebook).is_accepts('a')
+    # but a cycle that keeps pushing is reported instead of running forever
+    push_rulebook = NPDARulebook([
+        PDARule(1, None, 1, '$', ['x', '$']), PDARule(1, None, 1, 'x', ['x', 'x']),
+    ], FreeMoveBounds(max_steps=1000))
+    try:
+        NPDADesign(1, '$', [2], push_rulebook).is_accepts('')
+    except DivergenceError:
+        pass
+    else:
+        raise AssertionError('expected DivergenceError')
+    # the step bound is per chain, so many configurations with short chains are fine
+    short_rulebook = NPDARulebook([PDARule(state, None, state + 100, '$', ['$']) for state in range(10)],
+                                  FreeMoveBounds(max_steps=5, max_stack_depth=5))
+    # and the depth bound is on growth, so stacks already deeper than it are fine too
+    starts = set(PDAConfiguration(state, Stack(['$'] + ['x'] * 50)) for state in range(10))
+    assert len(short_rulebook.follow_free_moves(starts)) == 20
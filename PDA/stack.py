@@ -1,26 +1,105 @@
+class InternTable:
+    """One canonical object per key. The table is a plain dict for speed and is emptied when it
+    grows past max_size, so callers must still compare structurally when identity fails"""
+    MAX_SIZE = 1 << 16
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.objects = {}
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def intern(self, key, make, *args):
+        obj = self.objects.get(key)
+        if obj is None:
+            self.misses += 1
+            if len(self.objects) >= self.max_size:
+                self.objects.clear()
+            obj = self.objects[key] = make(*args)
+        else:
+            self.hits += 1
+        return obj
+
+    def __len__(self):
+        return len(self.objects)
+
+
 class Stack:
-    """Purely functional non-destructive stack"""
-    def __init__(self, list_):
-        self.stk = [e for e in list_]
+    """Purely functional non-destructive stack, a chain of cons cells that share their tails.
+    Cells are hash-consed, so equal stacks are normally the same object"""
+    __slots__ = ('head', 'tail', 'size', 'hash_')
+    intern_table = InternTable()
+
+    def __new__(cls, list_):
+        stack = Stack.EMPTY
+        for character in reversed(list(list_)):
+            stack = stack.push(character)
+        return stack
+
+    @staticmethod
+    def cons(head, tail, size, hash_):
+        stack = object.__new__(Stack)
+        stack.head, stack.tail, stack.size, stack.hash_ = head, tail, size, hash_
+        return stack
+
+    def __reduce__(self):
+        # intern again when unpickled
+        return Stack, (self.stk,)
+
+    @property
+    def stk(self):
+        res = []
+        stack = self
+        while stack.size:
+            res.append(stack.head)
+            stack = stack.tail
+        return res
 
     def __eq__(self, other):
-        return self.stk == other.stk
-    
+        a, b = self, other
+        # interned stacks are identical, the walk is only for stacks from before the table was emptied
+        while a is not b:
+            if a.size != b.size or a.hash_ != b.hash_ or a.head != b.head:
+                return False
+            if not a.size:
+                return True
+            a, b = a.tail, b.tail
+        return True
+
     def __hash__(self):
-        return hash(str(self))
+        return self.hash_
 
     def __str__(self):
         rest = ''.join((char for char in self.stk[1:]))
         return f'<Stack ({self.top()}){rest}>'
-    
+
     def pop(self):
-        return Stack(self.stk[1:])
+        return self.tail if self.size else self
 
     def push(self, character):
-        return Stack([character] + self.stk[:])
+        # the pushed cell keeps its tail alive for as long as the entry exists, so the tail's id is a safe key
+        table = Stack.intern_table
+        key = (character, id(self))
+        stack = table.objects.get(key)
+        if stack is None:
+            return table.intern(key, Stack.cons, character, self, self.size + 1, hash((character, self.hash_)))
+        table.hits += 1
+        return stack
+
+    def push_all(self, characters):
+        """Push so that characters[0] ends up on top"""
+        stack = self
+        for character in reversed(characters):
+            stack = stack.push(character)
+        return stack
 
     def top(self):
-        return self.stk[0]
+        if not self.size:
+            raise IndexError('top of empty stack')
+        return self.head
+
+
+Stack.EMPTY = Stack.cons(None, None, 0, hash(()))
 
 if __name__ == "__main__":
     print('-' * 20)
@@ -29,4 +108,29 @@ if __name__ == "__main__":
     print(stack.top())                              # a
     print(stack.pop().pop().top())                  # c
     print(stack.push('x').push('y').top())          # y
-    print(stack.push('x').push('y').pop().top())    # x
\ No newline at end of file
+    print(stack.push('x').push('y').pop().top())    # x
+
+    print('-' * 20)
+    assert stack.stk == ['a', 'b', 'c', 'd', 'e']
+    assert stack.push('x').pop() is stack
+    assert stack.push_all(['x', 'y']).stk == ['x', 'y', 'a', 'b', 'c', 'd', 'e']
+    assert stack.push('x') == Stack(['x', 'a', 'b', 'c', 'd', 'e'])
+    assert hash(stack.push('x')) == hash(Stack(['x', 'a', 'b', 'c', 'd', 'e']))
+    assert stack != stack.pop()
+    assert Stack([]) == Stack(['a']).pop()
+    assert stack.size == 5
+
+    print('-' * 20)
+    # a deep stack, each push and pop is constant time and every version shares the cells below it
+    deep = Stack(['$'])
+    for _ in range(100000):
+        deep = deep.push('b')
+    assert deep.size == 100001
+    assert deep.pop().pop().tail is deep.tail.tail.tail
+
+    print('-' * 20)
+    assert Stack(['a', 'b']) is Stack(['b']).push('a')
+    hits, misses = Stack.intern_table.hits, Stack.intern_table.misses
+    xyz = Stack(['x', 'y', 'z'])
+    assert Stack(['x', 'y', 'z']) is xyz
+    assert (Stack.intern_table.hits - hits, Stack.intern_table.misses - misses) == (3, 3)